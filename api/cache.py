@@ -0,0 +1,117 @@
+import os
+import time
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import text
+
+from .database import Database
+
+CACHE_TTL_SECONDS = int(os.getenv("API_CACHE_TTL_SECONDS", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("API_CACHE_MAX_ENTRIES", "256"))
+# How long a data-version lookup is trusted before asking Postgres again
+DATA_VERSION_CHECK_SECONDS = int(os.getenv("API_DATA_VERSION_CHECK_SECONDS", "30"))
+
+
+class CacheBackend(ABC):
+	"""Minimal interface for response cache backends (e.g. a Redis adapter)."""
+
+	@abstractmethod
+	def get(self, key: str) -> Optional[Any]:
+		...
+
+	@abstractmethod
+	def set(self, key: str, value: Any, ttl: int) -> None:
+		...
+
+	@abstractmethod
+	def clear(self) -> None:
+		...
+
+
+class TTLLRUCache(CacheBackend):
+	"""Thread-safe in-process LRU cache whose entries also expire after ``ttl`` seconds."""
+
+	def __init__(self, maxsize: int = CACHE_MAX_ENTRIES):
+		self.maxsize = maxsize
+		self._data: "OrderedDict[str, tuple]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key: str) -> Optional[Any]:
+		with self._lock:
+			entry = self._data.get(key)
+			if entry is None:
+				return None
+			expires_at, value = entry
+			if expires_at < time.monotonic():
+				del self._data[key]
+				return None
+			self._data.move_to_end(key)
+			return value
+
+	def set(self, key: str, value: Any, ttl: int) -> None:
+		with self._lock:
+			self._data[key] = (time.monotonic() + ttl, value)
+			self._data.move_to_end(key)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+
+	def clear(self) -> None:
+		with self._lock:
+			self._data.clear()
+
+
+_backend: CacheBackend = TTLLRUCache()
+_version = {"value": None, "checked_at": 0.0}
+
+
+def set_backend(backend: CacheBackend) -> None:
+	global _backend
+	_backend = backend
+
+
+async def get_data_version(conn: Database) -> str:
+	"""Stamp written by the pipeline after dbt runs (``src/data_version.py``)."""
+	now = time.monotonic()
+	if _version["value"] is not None and now - _version["checked_at"] < DATA_VERSION_CHECK_SECONDS:
+		return _version["value"]
+	version = "unversioned"
+	if await conn.scalar(text("select to_regclass('meta.data_version')")) is not None:
+		version = await conn.scalar(text("select version from meta.data_version")) or version
+	_version.update(value=version, checked_at=now)
+	return version
+
+
+async def cached_response(
+	request: Request,
+	response: Response,
+	conn: Database,
+	endpoint: str,
+	params: dict,
+	compute: Callable[[], Awaitable[Any]],
+):
+	"""Serve ``compute()`` through the cache, keyed by endpoint, params and data version.
+
+	Sets ``ETag``/``Cache-Control`` and answers ``If-None-Match`` with a 304.
+	A request sent with ``Cache-Control: no-cache`` is recomputed (and the
+	fresh result cached), which lets benchmarks time the uncached path.
+	"""
+	version = await get_data_version(conn)
+	key = f"{endpoint}:{version}:{sorted(params.items())!r}"
+	etag = '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+	headers = {"ETag": etag, "Cache-Control": f"public, max-age={CACHE_TTL_SECONDS}"}
+
+	if request.headers.get("if-none-match") == etag:
+		return Response(status_code=304, headers=headers)
+
+	no_cache = "no-cache" in request.headers.get("cache-control", "")
+	value = None if no_cache else _backend.get(key)
+	if value is None:
+		value = await compute()
+		_backend.set(key, value, CACHE_TTL_SECONDS)
+	response.headers.update(headers)
+	return value
@@ -1,11 +1,16 @@
 import os
-from typing import Generator
+from abc import ABC, abstractmethod
+from typing import Any, AsyncGenerator, List, Optional
 
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
 from sqlalchemy.pool import QueuePool
 from dotenv import load_dotenv
 
+from src.settings import env_flag
+
 load_dotenv()
 
 DB_HOST = os.getenv("DB_HOST", "localhost")
@@ -14,19 +19,111 @@ DB_NAME = os.getenv("DB_NAME", "medical_warehouse")
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
 
+# DB_ASYNC=true serves queries through asyncpg instead of psycopg2 on the threadpool
+DB_ASYNC = env_flag("DB_ASYNC")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+
 DB_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+ASYNC_DB_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+engine: Optional[Engine] = None
+async_engine: Optional[AsyncEngine] = None
+
+if DB_ASYNC:
+	async_engine = create_async_engine(
+		ASYNC_DB_URL,
+		pool_size=DB_POOL_SIZE,
+		max_overflow=DB_MAX_OVERFLOW,
+		pool_timeout=DB_POOL_TIMEOUT,
+		pool_pre_ping=True,
+	)
+else:
+	engine = create_engine(
+		DB_URL,
+		poolclass=QueuePool,
+		pool_size=DB_POOL_SIZE,
+		max_overflow=DB_MAX_OVERFLOW,
+		pool_timeout=DB_POOL_TIMEOUT,
+		pool_pre_ping=True,
+	)
+
+
+class Database(ABC):
+	"""Awaitable query interface shared by the sync and async engines."""
+
+	@abstractmethod
+	async def fetch_all(self, statement, params: Optional[dict] = None) -> List[Any]:
+		...
+
+	@abstractmethod
+	async def scalar(self, statement, params: Optional[dict] = None) -> Any:
+		...
+
+
+class AsyncDatabase(Database):
+	def __init__(self, conn: AsyncConnection):
+		self.conn = conn
+
+	async def fetch_all(self, statement, params: Optional[dict] = None) -> List[Any]:
+		result = await self.conn.execute(statement, params or {})
+		return result.fetchall()
+
+	async def scalar(self, statement, params: Optional[dict] = None) -> Any:
+		result = await self.conn.execute(statement, params or {})
+		return result.scalar()
+
+
+class SyncDatabase(Database):
+	"""Runs blocking psycopg2 calls on FastAPI's threadpool."""
+
+	def __init__(self, conn: Connection):
+		self.conn = conn
+
+	async def fetch_all(self, statement, params: Optional[dict] = None) -> List[Any]:
+		return await run_in_threadpool(lambda: self.conn.execute(statement, params or {}).fetchall())
+
+	async def scalar(self, statement, params: Optional[dict] = None) -> Any:
+		return await run_in_threadpool(lambda: self.conn.execute(statement, params or {}).scalar())
+
+
+async def get_connection() -> AsyncGenerator[Database, None]:
+	if DB_ASYNC:
+		async with async_engine.connect() as conn:
+			yield AsyncDatabase(conn)
+		return
+
+	conn = await run_in_threadpool(engine.connect)
+	try:
+		yield SyncDatabase(conn)
+	finally:
+		await run_in_threadpool(conn.close)
+
+
+async def stream_rows(statement, params: Optional[dict] = None, batch_size: int = 1000) -> AsyncGenerator[Any, None]:
+	"""Yield rows through a server-side cursor on a dedicated connection.
 
-engine: Engine = create_engine(
-	DB_URL,
-	poolclass=QueuePool,
-	pool_size=5,
-	max_overflow=10,
-	pool_pre_ping=True,
-)
+	Used by streaming responses, which outlive request-scoped dependencies.
+	"""
+	if DB_ASYNC:
+		async with async_engine.connect() as conn:
+			result = await conn.stream(statement, params or {})
+			async for partition in result.partitions(batch_size):
+				for row in partition:
+					yield row
+		return
 
-def get_connection() -> Generator:
-	conn = engine.connect()
+	conn = await run_in_threadpool(engine.connect)
 	try:
-		yield conn
+		result = await run_in_threadpool(
+			lambda: conn.execution_options(stream_results=True).execute(statement, params or {})
+		)
+		while True:
+			rows = await run_in_threadpool(result.fetchmany, batch_size)
+			if not rows:
+				break
+			for row in rows:
+				yield row
 	finally:
-		conn.close()
+		await run_in_threadpool(conn.close)
@@ -1,11 +1,17 @@
+import io
 import os
-from typing import List
+import csv
+import json
+from datetime import date, datetime
+from typing import List, Optional, Literal
 
-from fastapi import FastAPI, Depends, Query
-from sqlalchemy.engine import Connection
+from fastapi import FastAPI, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy import text
 
-from .database import get_connection
+from .cache import cached_response
+from .database import Database, get_connection, stream_rows
+from .pagination import encode_cursor, decode_cursor, cursor_value
 from .schemas import (
 	TopProductItem,
 	TopProductsResponse,
@@ -24,100 +30,266 @@ DBT_SCHEMA = os.getenv("DBT_SCHEMA", "staging")
 
 
 @app.get("/api/reports/top-products", response_model=TopProductsResponse, tags=["Reports"], summary="Top frequently mentioned terms/products")
-def top_products(limit: int = Query(10, ge=1, le=100), conn: Connection = Depends(get_connection)):
-	# Simple tokenization using Postgres; filter short tokens and common stopwords
-	stopwords = "the a an and or to for of in on with at by from is are was were be been being this that these those"
+async def top_products(
+	request: Request,
+	response: Response,
+	limit: int = Query(10, ge=1, le=100),
+	channel: Optional[str] = Query(None, description="Restrict to one channel"),
+	start_date: Optional[date] = Query(None),
+	end_date: Optional[date] = Query(None),
+	conn: Database = Depends(get_connection),
+):
+	# Terms are tokenised and stopword-filtered once per day by the fct_term_counts mart
+	filters = []
+	params = {"limit": limit}
+	if channel:
+		filters.append("t.channel_name = :channel")
+		params["channel"] = channel
+	if start_date:
+		filters.append("t.term_date >= :start_date")
+		params["start_date"] = start_date
+	if end_date:
+		filters.append("t.term_date <= :end_date")
+		params["end_date"] = end_date
+	where = f"where {' and '.join(filters)}" if filters else ""
 	query = text(f"""
-		with tokens as (
-			select lower(t) as term
-			from {DBT_SCHEMA}.fct_message m,
-				 regexp_split_to_table(m.message_text, '\\W+') t
-		)
-		select term, count(*) as count
-		from tokens
-		where length(term) >= 3
-		  and term not in (select unnest(string_to_array(:stopwords, ' ')))
-		group by term
+		select t.term, sum(t.term_count) as count
+		from {DBT_SCHEMA}.fct_term_counts t
+		{where}
+		group by t.term
 		order by count desc
 		limit :limit
 	""")
-	rows = conn.execute(query, {"limit": limit, "stopwords": stopwords}).fetchall()
-	items = [TopProductItem(term=r[0], count=r[1]) for r in rows]
-	return TopProductsResponse(items=items)
+
+	async def compute():
+		rows = await conn.fetch_all(query, params)
+		return TopProductsResponse(items=[TopProductItem(term=r[0], count=r[1]) for r in rows])
+
+	return await cached_response(request, response, conn, "top_products", params, compute)
 
 
 @app.get("/api/channels/{channel_name}/activity", response_model=ChannelActivityResponse, tags=["Channels"], summary="Daily activity and engagement for a channel")
-def channel_activity(channel_name: str, conn: Connection = Depends(get_connection)):
+async def channel_activity(
+	channel_name: str,
+	request: Request,
+	response: Response,
+	limit: int = Query(366, ge=1, le=1000, description="Days per page"),
+	cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+	start_date: Optional[date] = Query(None),
+	end_date: Optional[date] = Query(None),
+	conn: Database = Depends(get_connection),
+):
+	# Served from the agg_channel_daily rollup: one indexed row per channel and day
+	filters = ["a.channel_name = :channel_name"]
+	params = {"channel_name": channel_name, "limit": limit + 1}
+	if start_date:
+		filters.append("a.activity_date >= :start_date")
+		params["start_date"] = start_date
+	if end_date:
+		filters.append("a.activity_date <= :end_date")
+		params["end_date"] = end_date
+	after = decode_cursor(cursor, 1)
+	if after:
+		filters.append("a.activity_date > cast(:after_date as date)")
+		params["after_date"] = cursor_value(after[0], date)
 	query = text(f"""
 		select
-			date_trunc('day', m.date_key)::date as date,
-			count(*) as posts,
-			avg(m.views)::float as avg_views,
-			avg(m.forward_count)::float as avg_forwards
-		from {DBT_SCHEMA}.fct_message m
-		join {DBT_SCHEMA}.dim_channels c on m.channel_key = c.channel_key
-		where c.channel_name = :channel_name
-		group by date
-		order by date asc
+			a.activity_date as date,
+			a.post_count as posts,
+			a.total_views::float / nullif(a.viewed_posts, 0) as avg_views,
+			a.total_forwards::float / nullif(a.forwarded_posts, 0) as avg_forwards
+		from {DBT_SCHEMA}.agg_channel_daily a
+		where {' and '.join(filters)}
+		order by a.activity_date asc
+		limit :limit
 	""")
-	rows = conn.execute(query, {"channel_name": channel_name}).fetchall()
-	items = [ChannelActivityItem(date=r[0], posts=r[1], avg_views=r[2], avg_forwards=r[3]) for r in rows]
-	return ChannelActivityResponse(channel_name=channel_name, items=items)
+
+	async def compute():
+		rows = await conn.fetch_all(query, params)
+		next_cursor = None
+		if len(rows) > limit:
+			rows = rows[:limit]
+			next_cursor = encode_cursor([rows[-1][0]])
+		items = [ChannelActivityItem(date=r[0], posts=r[1], avg_views=r[2], avg_forwards=r[3]) for r in rows]
+		return ChannelActivityResponse(channel_name=channel_name, items=items, next_cursor=next_cursor)
+
+	return await cached_response(request, response, conn, "channel_activity", params, compute)
 
 
 @app.get("/api/search/messages", response_model=MessageSearchResponse, tags=["Search"], summary="Search messages by keyword")
-def search_messages(query: str = Query(..., min_length=2), limit: int = Query(20, ge=1, le=100), conn: Connection = Depends(get_connection)):
-	sql = text(f"""
-		select m.message_id, c.channel_name, m.date_key, m.message_text, m.views, m.forward_count, m.has_image
-		from {DBT_SCHEMA}.fct_message m
-		join {DBT_SCHEMA}.dim_channels c on m.channel_key = c.channel_key
-		where m.message_text ilike :pattern
-		order by m.date_key desc
-		limit :limit
-	""")
-	rows = conn.execute(sql, {"pattern": f"%{query}%", "limit": limit}).fetchall()
+async def search_messages(
+	query: str = Query(..., min_length=2),
+	limit: int = Query(20, ge=1, le=100),
+	cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+	mode: Literal["fulltext", "substring"] = Query("fulltext", description="fulltext uses the ranked tsvector index; substring is a plain ILIKE match"),
+	conn: Database = Depends(get_connection),
+):
+	params = {"limit": limit + 1}
+	after = decode_cursor(cursor, 3)
+	keyset = ""
+	if mode == "fulltext":
+		# Ranked match against the GIN-indexed search_vector built in fct_message
+		if after:
+			keyset = "where (rank, channel_key, message_id) < (cast(:after_rank as real), :after_channel, :after_id)"
+			params.update(
+				after_rank=cursor_value(after[0], float),
+				after_channel=cursor_value(after[1], str),
+				after_id=cursor_value(after[2], int),
+			)
+		sql = text(f"""
+			select * from (
+				select m.message_id, c.channel_name, m.date_key, m.message_text, m.views, m.forward_count, m.has_image,
+					   m.channel_key, ts_rank(m.search_vector, q) as rank
+				from {DBT_SCHEMA}.fct_message m
+				join {DBT_SCHEMA}.dim_channels c on m.channel_key = c.channel_key,
+					 websearch_to_tsquery('simple', :query) q
+				where m.search_vector @@ q
+			) hits
+			{keyset}
+			order by rank desc, channel_key desc, message_id desc
+			limit :limit
+		""")
+		params["query"] = query
+	else:
+		if after:
+			keyset = "and (m.date_key, m.channel_key, m.message_id) < (cast(:after_date as timestamp), :after_channel, :after_id)"
+			params.update(
+				after_date=cursor_value(after[0], datetime),
+				after_channel=cursor_value(after[1], str),
+				after_id=cursor_value(after[2], int),
+			)
+		sql = text(f"""
+			select m.message_id, c.channel_name, m.date_key, m.message_text, m.views, m.forward_count, m.has_image,
+				   m.channel_key, null::real as rank
+			from {DBT_SCHEMA}.fct_message m
+			join {DBT_SCHEMA}.dim_channels c on m.channel_key = c.channel_key
+			where m.message_text ilike :pattern
+			{keyset}
+			order by m.date_key desc, m.channel_key desc, m.message_id desc
+			limit :limit
+		""")
+		params["pattern"] = f"%{query}%"
+
+	rows = await conn.fetch_all(sql, params)
+	next_cursor = None
+	if len(rows) > limit:
+		rows = rows[:limit]
+		last = rows[-1]
+		next_cursor = encode_cursor([last[8] if mode == "fulltext" else last[2], last[7], last[0]])
 	items = [
 		MessageItem(
-			message_id=r[0], channel_name=r[1], date=r[2], message_text=r[3], views=r[4], forward_count=r[5], has_image=r[6]
+			message_id=r[0], channel_name=r[1], date=r[2], message_text=r[3], views=r[4], forward_count=r[5], has_image=r[6], rank=r[8]
 		)
 		for r in rows
 	]
-	return MessageSearchResponse(items=items)
+	return MessageSearchResponse(items=items, next_cursor=next_cursor)
 
 
 @app.get("/api/reports/visual-content", response_model=VisualContentStatsResponse, tags=["Reports"], summary="Visual content stats across channels")
-def visual_content_stats(conn: Connection = Depends(get_connection)):
-	# Prefer image category from detections if available; fallback to has_image flag
+async def visual_content_stats(
+	request: Request,
+	response: Response,
+	start_date: Optional[date] = Query(None),
+	end_date: Optional[date] = Query(None),
+	conn: Database = Depends(get_connection),
+):
+	# agg_channel_daily counts each image once, under a single category
+	filters = []
+	params = {}
+	if start_date:
+		filters.append("a.activity_date >= :start_date")
+		params["start_date"] = start_date
+	if end_date:
+		filters.append("a.activity_date <= :end_date")
+		params["end_date"] = end_date
+	where = f"where {' and '.join(filters)}" if filters else ""
 	sql = text(f"""
-		with base as (
-			select c.channel_name,
-				   coalesce(d.image_category, case when m.has_image then 'unknown' else null end) as image_category
-			from {DBT_SCHEMA}.fct_message m
-			join {DBT_SCHEMA}.dim_channels c on m.channel_key = c.channel_key
-			left join {DBT_SCHEMA}.fct_image_detections d on d.message_id = m.message_id
-			where m.has_image = true
-		)
-		select channel_name,
-			   count(*) as total_images,
-			   sum(case when image_category = 'promotional' then 1 else 0 end) as promotional_images,
-			   sum(case when image_category = 'product_display' then 1 else 0 end) as product_display_images,
-			   sum(case when image_category = 'lifestyle' then 1 else 0 end) as lifestyle_images,
-			   sum(case when image_category = 'other' then 1 else 0 end) as other_images
-		from base
-		group by channel_name
+		select a.channel_name,
+			   sum(a.image_count) as total_images,
+			   sum(a.promotional_images) as promotional_images,
+			   sum(a.product_display_images) as product_display_images,
+			   sum(a.lifestyle_images) as lifestyle_images,
+			   sum(a.other_images) as other_images
+		from {DBT_SCHEMA}.agg_channel_daily a
+		{where}
+		group by a.channel_name
+		having sum(a.image_count) > 0
 		order by total_images desc
 	""")
-	rows = conn.execute(sql).fetchall()
-	items = [
-		VisualContentStatsItem(
-			channel_name=r[0], total_images=r[1], promotional_images=r[2], product_display_images=r[3], lifestyle_images=r[4], other_images=r[5]
-		)
-		for r in rows
-	]
-	return VisualContentStatsResponse(items=items)
+
+	async def compute():
+		rows = await conn.fetch_all(sql, params)
+		items = [
+			VisualContentStatsItem(
+				channel_name=r[0], total_images=r[1], promotional_images=r[2], product_display_images=r[3], lifestyle_images=r[4], other_images=r[5]
+			)
+			for r in rows
+		]
+		return VisualContentStatsResponse(items=items)
+
+	return await cached_response(request, response, conn, "visual_content_stats", params, compute)
+
+
+EXPORT_COLUMNS = ["message_id", "channel_name", "date", "message_text", "views", "forward_count", "has_image"]
+# Rows per chunk written to the wire
+EXPORT_CHUNK_ROWS = 500
+
+
+@app.get("/api/export/messages", tags=["Export"], summary="Stream messages as NDJSON or CSV")
+async def export_messages(
+	format: Literal["ndjson", "csv"] = Query("ndjson"),
+	channel: Optional[str] = Query(None),
+	start_date: Optional[date] = Query(None),
+	end_date: Optional[date] = Query(None),
+):
+	# Rows come from a server-side cursor and are written out in small chunks,
+	# so the export never holds the full result set in memory.
+	filters = []
+	params = {}
+	if channel:
+		filters.append("c.channel_name = :channel")
+		params["channel"] = channel
+	if start_date:
+		filters.append("m.date_key >= :start_date")
+		params["start_date"] = start_date
+	if end_date:
+		filters.append("m.date_key < cast(:end_date as date) + 1")
+		params["end_date"] = end_date
+	where = f"where {' and '.join(filters)}" if filters else ""
+	sql = text(f"""
+		select m.message_id, c.channel_name, m.date_key, m.message_text, m.views, m.forward_count, m.has_image
+		from {DBT_SCHEMA}.fct_message m
+		join {DBT_SCHEMA}.dim_channels c on m.channel_key = c.channel_key
+		{where}
+		order by m.date_key, m.channel_key, m.message_id
+	""")
+
+	async def body():
+		buf = io.StringIO()
+		writer = csv.writer(buf)
+		if format == "csv":
+			writer.writerow(EXPORT_COLUMNS)
+		rows = 0
+		async for r in stream_rows(sql, params):
+			if format == "csv":
+				writer.writerow(r)
+			else:
+				buf.write(json.dumps(dict(zip(EXPORT_COLUMNS, r)), default=str, ensure_ascii=False))
+				buf.write("\n")
+			rows += 1
+			if rows % EXPORT_CHUNK_ROWS == 0:
+				yield buf.getvalue()
+				buf.seek(0)
+				buf.truncate()
+		if buf.tell():
+			yield buf.getvalue()
+
+	media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+	headers = {"Content-Disposition": f'attachment; filename="messages.{format}"'}
+	return StreamingResponse(body(), media_type=media_type, headers=headers)
 
 
 # Root & docs helpers
 @app.get("/", summary="Health check")
-def root():
+async def root():
 	return {"status": "ok"}
@@ -0,0 +1,44 @@
+import json
+import base64
+from datetime import date, datetime
+from typing import List, Optional, Union
+
+from fastapi import HTTPException
+
+
+def encode_cursor(values: list) -> str:
+	"""Opaque keyset cursor for the last row of a page."""
+	raw = json.dumps(values, default=str, separators=(",", ":")).encode()
+	return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], size: int) -> Optional[List]:
+	if cursor is None:
+		return None
+	try:
+		padded = cursor + "=" * (-len(cursor) % 4)
+		values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+	except ValueError:
+		raise HTTPException(status_code=400, detail="Invalid cursor")
+	if not isinstance(values, list) or len(values) != size:
+		raise HTTPException(status_code=400, detail="Invalid cursor")
+	return values
+
+
+def cursor_value(value, kind: type) -> Union[date, datetime, float, int, str]:
+	"""Check a decoded cursor value and return it as ``kind``.
+
+	Dates and timestamps round-trip through JSON as strings and are parsed
+	back, since asyncpg only binds real date/time objects; numbers and strings
+	must already have the right JSON type. Anything else is a tampered cursor
+	and answers 400 instead of failing in the query.
+	"""
+	if kind in (date, datetime):
+		try:
+			return kind.fromisoformat(value)
+		except (TypeError, ValueError):
+			raise HTTPException(status_code=400, detail="Invalid cursor")
+	allowed = (int, float) if kind is float else (kind,)
+	if isinstance(value, bool) or not isinstance(value, allowed):
+		raise HTTPException(status_code=400, detail="Invalid cursor")
+	return kind(value)
@@ -11,8 +11,9 @@ class TopProductItem(BaseModel):
 class ChannelActivityItem(BaseModel):
 	date: date
 	posts: int
-	avg_views: float
-	avg_forwards: float
+	# None when no message that day has a count
+	avg_views: Optional[float] = None
+	avg_forwards: Optional[float] = None
 
 
 class MessageItem(BaseModel):
@@ -23,6 +24,7 @@ class MessageItem(BaseModel):
 	views: int
 	forward_count: int
 	has_image: bool
+	rank: Optional[float] = Field(default=None, description="Full-text relevance (fulltext mode only)")
 
 
 class VisualContentStatsItem(BaseModel):
@@ -41,10 +43,12 @@ class TopProductsResponse(BaseModel):
 class ChannelActivityResponse(BaseModel):
 	channel_name: str
 	items: List[ChannelActivityItem]
+	next_cursor: Optional[str] = Field(default=None, description="Pass as cursor to fetch the next page")
 
 
 class MessageSearchResponse(BaseModel):
 	items: List[MessageItem]
+	next_cursor: Optional[str] = Field(default=None, description="Pass as cursor to fetch the next page")
 
 
 class VisualContentStatsResponse(BaseModel):
@@ -0,0 +1,80 @@
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key='activity_date',
+    on_schema_change='append_new_columns',
+    post_hook=[
+        "create index if not exists {{ this.name }}_channel_date_idx on {{ this }} (channel_name, activity_date)",
+    ]
+) }}
+
+-- Daily engagement and image mix per channel, backing /api/channels/{name}/activity
+-- and /api/reports/visual-content. Incremental runs rebuild every day that has
+-- messages or detections loaded since the last build.
+with
+{% if is_incremental() %}
+touched_days as (
+    select distinct date_key::date as activity_date
+    from {{ ref('fct_message') }}
+    where loaded_at > (select coalesce(max(messages_loaded_at), '1900-01-01') from {{ this }})
+    union
+    select distinct date_key::date
+    from {{ ref('fct_image_detections') }}
+    where loaded_at > (select coalesce(max(detections_loaded_at), '1900-01-01') from {{ this }})
+),
+{% endif %}
+
+messages as (
+    select
+        m.channel_key,
+        m.message_id,
+        m.date_key::date as activity_date,
+        m.views,
+        m.forward_count,
+        m.has_image,
+        m.loaded_at
+    from {{ ref('fct_message') }} m
+    {% if is_incremental() %}
+    where m.date_key::date in (select activity_date from touched_days)
+    {% endif %}
+),
+
+-- One category per image, however many boxes were detected on it
+image_categories as (
+    select distinct on (d.channel_key, d.message_id)
+        d.channel_key,
+        d.message_id,
+        d.image_category,
+        d.loaded_at
+    from {{ ref('fct_image_detections') }} d
+    {% if is_incremental() %}
+    where d.date_key::date in (select activity_date from touched_days)
+    {% endif %}
+    order by d.channel_key, d.message_id, d.confidence_score desc
+)
+
+select
+    c.channel_key,
+    c.channel_name,
+    m.activity_date,
+    count(*) as post_count,
+    coalesce(sum(m.views), 0) as total_views,
+    coalesce(sum(m.forward_count), 0) as total_forwards,
+    -- Averages divide by these, so messages without a count are left out as avg() would
+    count(m.views) as viewed_posts,
+    count(m.forward_count) as forwarded_posts,
+    count(*) filter (where m.has_image) as image_count,
+    count(*) filter (where m.has_image and i.image_category = 'promotional') as promotional_images,
+    count(*) filter (where m.has_image and i.image_category = 'product_display') as product_display_images,
+    count(*) filter (where m.has_image and i.image_category = 'lifestyle') as lifestyle_images,
+    count(*) filter (where m.has_image and i.image_category = 'other') as other_images,
+    count(*) filter (where m.has_image and i.image_category is null) as unclassified_images,
+    max(m.loaded_at) as messages_loaded_at,
+    max(i.loaded_at) as detections_loaded_at
+from messages m
+join {{ ref('dim_channels') }} c
+  on m.channel_key = c.channel_key
+left join image_categories i
+  on m.channel_key = i.channel_key
+ and m.message_id = i.message_id
+group by c.channel_key, c.channel_name, m.activity_date
@@ -3,8 +3,10 @@ with source as (
     from {{ ref('stg_telegram_messages') }}
 )
 
+-- channel_key is a hash of the natural key so it stays stable across rebuilds
+-- and incremental facts keep pointing at the right channel.
 select
-    row_number() over () as channel_key,
+    md5(channel_name) as channel_key,
     channel_name,
     case
         when channel_name ilike '%pharma%' then 'Pharmaceutical'
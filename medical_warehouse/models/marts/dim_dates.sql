@@ -1,6 +1,18 @@
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key='date_key'
+) }}
+
 with source as (
-    select distinct message_date
+    select
+        message_date,
+        max(loaded_at) as loaded_at
     from {{ ref('stg_telegram_messages') }}
+    {% if is_incremental() %}
+    where loaded_at > (select coalesce(max(loaded_at), '1900-01-01') from {{ this }})
+    {% endif %}
+    group by message_date
 )
 
 select
@@ -13,5 +25,6 @@ select
     to_char(message_date, 'Month') as month_name,
     extract(quarter from message_date) as quarter,
     extract(year from message_date) as year,
-    case when extract(dow from message_date) in (0,6) then true else false end as is_weekend
+    case when extract(dow from message_date) in (0,6) then true else false end as is_weekend,
+    loaded_at
 from source
@@ -1,8 +1,29 @@
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key='detection_date',
+    post_hook=[
+        "create index if not exists {{ this.name }}_message_idx on {{ this }} (channel_key, message_id)",
+    ]
+) }}
+
+-- raw.image_detections is reloaded a whole detection_date at a time, so
+-- incremental runs rebuild every day that has rows loaded since the last build.
 with detections as (
     select * from raw.image_detections
+    {% if is_incremental() %}
+    where detection_date in (
+        select distinct detection_date
+        from raw.image_detections
+        where loaded_at > (select coalesce(max(loaded_at), '1900-01-01') from {{ this }})
+    )
+    {% endif %}
 ),
 messages as (
-    select * from {{ ref('fct_messages') }}
+    select * from {{ ref('fct_message') }}
+),
+channels as (
+    select * from {{ ref('dim_channels') }}
 )
 
 select
@@ -12,7 +33,12 @@ select
     d.detected_class,
     d.confidence as confidence_score,
     d.image_category,
-    d.image_path
+    d.image_path,
+    d.detection_date,
+    d.loaded_at
 from detections d
+join channels c
+  on d.channel_name = c.channel_name
 join messages m
   on d.message_id = m.message_id
+ and c.channel_key = m.channel_key
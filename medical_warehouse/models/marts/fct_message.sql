@@ -1,3 +1,16 @@
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key=['channel_key', 'message_id'],
+    post_hook=[
+        "create index if not exists {{ this.name }}_search_idx on {{ this }} using gin (search_vector)",
+        "create index if not exists {{ this.name }}_date_idx on {{ this }} (date_key desc, channel_key desc, message_id desc)",
+        "create index if not exists {{ this.name }}_loaded_at_idx on {{ this }} (loaded_at)",
+    ]
+) }}
+
+-- Incremental runs only pick up raw rows (re)loaded since the last build,
+-- which also refreshes views/forwards of re-scraped messages.
 select
     s.message_id,
     c.channel_key,
@@ -6,9 +19,14 @@ select
     s.message_length,
     s.views,
     s.forwards as forward_count,
-    s.has_image
+    s.has_image,
+    to_tsvector('simple', coalesce(s.message_text, '')) as search_vector,
+    s.loaded_at
 from {{ ref('stg_telegram_messages') }} s
 join {{ ref('dim_channels') }} c
   on s.channel_name = c.channel_name
 join {{ ref('dim_dates') }} d
   on s.message_date = d.date_key
+{% if is_incremental() %}
+where s.loaded_at > (select coalesce(max(loaded_at), '1900-01-01') from {{ this }})
+{% endif %}
@@ -0,0 +1,60 @@
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key='term_date',
+    on_schema_change='append_new_columns',
+    post_hook=[
+        "create index if not exists {{ this.name }}_lookup_idx on {{ this }} (term_date, channel_name)",
+    ]
+) }}
+
+-- Term counts per day and channel, tokenised and stopword-filtered once at build time.
+-- Incremental runs rebuild every day that has messages loaded since the last build,
+-- however old their post dates (backfills, newly registered channels).
+with
+{% if is_incremental() %}
+touched_days as (
+    select distinct date_key::date as term_date
+    from {{ ref('fct_message') }}
+    where loaded_at > (select coalesce(max(messages_loaded_at), '1900-01-01') from {{ this }})
+),
+{% endif %}
+
+messages as (
+    select
+        c.channel_name,
+        m.date_key::date as term_date,
+        m.message_text,
+        m.loaded_at
+    from {{ ref('fct_message') }} m
+    join {{ ref('dim_channels') }} c
+      on m.channel_key = c.channel_key
+    {% if is_incremental() %}
+    where m.date_key::date in (select term_date from touched_days)
+    {% endif %}
+),
+
+tokens as (
+    select
+        m.term_date,
+        m.channel_name,
+        lower(t) as term,
+        m.loaded_at
+    from messages m,
+         regexp_split_to_table(m.message_text, '\W+') t
+)
+
+select
+    term_date,
+    channel_name,
+    term,
+    count(*) as term_count,
+    max(loaded_at) as messages_loaded_at
+from tokens
+where length(term) >= 3
+  and term not in (
+    {%- for word in var('stopwords') %}
+      '{{ word }}'{{ "," if not loop.last }}
+    {%- endfor %}
+  )
+group by term_date, channel_name, term
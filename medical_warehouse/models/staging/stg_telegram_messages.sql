@@ -12,6 +12,7 @@ cleaned AS (
         forwards::INTEGER,
         has_media::BOOLEAN,
         image_path::TEXT,
+        loaded_at::TIMESTAMPTZ,
         LENGTH(message_text) AS message_length,
         CASE WHEN has_media THEN TRUE ELSE FALSE END AS has_image
     FROM source
@@ -1,140 +1,297 @@
+import io
 import os
 import sys
+import importlib
 import subprocess
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timezone
 from pathlib import Path
 
-from dagster import op, job, ScheduleDefinition, Definitions, Failure, HookContext
+from dagster import (
+    AssetExecutionContext,
+    AssetSelection,
+    BackfillPolicy,
+    DailyPartitionsDefinition,
+    Definitions,
+    Failure,
+    MaterializeResult,
+    RunFailureSensorContext,
+    asset,
+    build_schedule_from_partitioned_job,
+    define_asset_job,
+    in_process_executor,
+    multiprocess_executor,
+    run_failure_sensor,
+)
 
 ROOT = Path(__file__).parent
 PROJECT_DIR = ROOT / "medical_warehouse"
+SRC_DIR = ROOT / "src"
+
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
 
+from settings import env_flag  # noqa: E402
 
-def run_cmd(cmd, cwd: Path | None = None, env: dict | None = None):
-    """Run a shell command and raise on failure."""
-    result = subprocess.run(
+# In-process mode imports the src modules and calls them directly (dbt through
+# its programmatic runner) instead of spawning a fresh interpreter per step.
+IN_PROCESS = env_flag("PIPELINE_IN_PROCESS", True)
+# "in_process" runs every step in one process so the warm YOLO model is shared
+# across stages and partitions, at the cost of branch parallelism.
+EXECUTOR = os.getenv("PIPELINE_EXECUTOR", "multiprocess")
+
+# One partition per scrape day; backfills fan out over a date range. end_offset=1
+# makes the current UTC day a partition, so the 02:00 schedule runs today's scrape.
+daily_partitions = DailyPartitionsDefinition(
+    start_date=os.getenv("PIPELINE_START_DATE", "2025-01-01"),
+    timezone="UTC",
+    end_offset=1,
+)
+
+
+def run_cmd(cmd, cwd: Path | None = None, env: dict | None = None, log=print):
+    """Run a command, streaming each output line to ``log``; return the exit code."""
+    proc = subprocess.Popen(
         cmd,
         cwd=str(cwd) if cwd else None,
         env=env or os.environ.copy(),
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
         text=True,
+        bufsize=1,
     )
-    return result
+    for line in proc.stdout:
+        if line.strip():
+            log(line.rstrip())
+    return proc.wait()
+
+
+class ContextLogStream(io.TextIOBase):
+    """File-like object forwarding complete lines to a Dagster logger."""
+
+    def __init__(self, log):
+        self.log = log
+        self._buf = ""
+
+    def write(self, s):
+        self._buf += s
+        while "\n" in self._buf:
+            line, self._buf = self._buf.split("\n", 1)
+            if line.strip():
+                self.log(line)
+        return len(s)
+
+    def flush(self):
+        if self._buf.strip():
+            self.log(self._buf)
+        self._buf = ""
+
+
+@contextmanager
+def step_logging(context):
+    """Route print() and loguru output of in-process steps into the Dagster log, live."""
+    from loguru import logger
+
+    stream = ContextLogStream(context.log.info)
+    sink_id = logger.add(lambda message: context.log.info(message.rstrip()), format="{message}")
+    cwd = os.getcwd()
+    os.chdir(ROOT)  # src modules use paths relative to the repo root
+    try:
+        with redirect_stdout(stream):
+            yield
+    finally:
+        stream.flush()
+        logger.remove(sink_id)
+        os.chdir(cwd)
+
+
+def run_step(context, name: str, func, cmd, failure: str, cwd: Path = ROOT) -> dict:
+    """Run ``func`` in-process (or ``cmd`` as a subprocess) inside a metrics span.
+
+    Returns the durations and counters of every span finished during the step,
+    ready to be attached as Dagster metadata.
+    """
+    metrics = src_module("metrics")
+    metrics.set_run_id(context.run_id)
+    metrics.drain_completed()
+    env = {**os.environ, "PIPELINE_RUN_ID": context.run_id}
+
+    with metrics.span(f"pipeline.{name}"):
+        if IN_PROCESS:
+            try:
+                with step_logging(context):
+                    func()
+            except Exception as e:
+                raise Failure(description=f"{failure}: {e}") from e
+        elif run_cmd(cmd, cwd=cwd, env=env, log=context.log.info) != 0:
+            raise Failure(description=failure)
+
+    metadata = {}
+    for s in metrics.drain_completed():
+        metadata[f"{s.stage}.duration_seconds"] = round(s.duration_seconds, 3)
+        for counter, value in s.counters.items():
+            metadata[f"{s.stage}.{counter}"] = value
+    context.log.info(f"{name} finished in {metadata[f'pipeline.{name}.duration_seconds']:.1f}s")
+    return metadata
+
+
+def src_module(name: str):
+    return importlib.import_module(name)
+
+
+def src_cmd(script: str, *args):
+    return [sys.executable, str(SRC_DIR / script), *args]
+
+
+def dbt_args(*args):
+    return [*args, "--project-dir", str(PROJECT_DIR), "--profiles-dir", str(PROJECT_DIR)]
+
+
+def invoke_dbt(*args):
+    # dbt logs to stdout, which step_logging already forwards to Dagster
+    from dbt.cli.main import dbtRunner
+
+    result = dbtRunner().invoke(dbt_args(*args))
+    if not result.success:
+        raise RuntimeError(result.exception or f"dbt {args[0]} reported failures")
 
 
-@op(description="Scrape Telegram channels and download images")
-def scrape_telegram_data(context):
+def run_dbt(context, *args, failure: str) -> dict:
+    return run_step(
+        context,
+        f"dbt {' '.join(args)}",
+        lambda: invoke_dbt(*args),
+        ["dbt", *dbt_args(*args)],
+        failure,
+        cwd=PROJECT_DIR,
+    )
+
+
+def bump_data_version(context) -> dict:
+    """Stamp a new data version so the API's response cache drops stale reports."""
+
+    def bump():
+        src_module("data_version").main()
+
+    return run_step(context, "data version", bump, src_cmd("data_version.py"), "Writing data version failed")
+
+
+@asset(partitions_def=daily_partitions, description="Scrape Telegram channels and download images")
+def telegram_raw_files(context: AssetExecutionContext):
+    # Telegram only serves the current state of a channel, so past partitions
+    # are not re-scraped; their files are already on disk.
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    if context.partition_key != today:
+        context.log.info(f"Skipping scrape for past partition {context.partition_key}")
+        return MaterializeResult(metadata={"skipped": True})
     context.log.info("Starting Telegram scrape...")
-    cmd = [sys.executable, str(ROOT / "src" / "scraper.py")]
-    result = run_cmd(cmd, cwd=ROOT)
-    context.log.info(result.stdout)
-    if result.returncode != 0:
-        raise Failure(description="Scraper failed")
+    metadata = run_step(context, "scrape", lambda: src_module("scraper").run(), src_cmd("scraper.py"), "Scraper failed")
     context.log.info("Scrape completed.")
+    return MaterializeResult(metadata=metadata)
 
 
-@op(description="Load raw JSON messages into Postgres (raw.telegram_messages)")
-def load_raw_to_postgres(context):
-    context.log.info("Loading raw JSON into Postgres...")
-    cmd = [sys.executable, str(ROOT / "src" / "load_raw_to_postgres.py")]
-    result = run_cmd(cmd, cwd=ROOT)
-    context.log.info(result.stdout)
-    if result.returncode != 0:
-        raise Failure(description="Load to Postgres failed")
+@asset(
+    partitions_def=daily_partitions,
+    deps=[telegram_raw_files],
+    description="Load raw messages into Postgres (raw.telegram_messages)",
+)
+def raw_telegram_messages(context: AssetExecutionContext):
+    date = context.partition_key
+    context.log.info(f"Loading raw messages for {date} into Postgres...")
+    metadata = run_step(
+        context,
+        "load raw messages",
+        lambda: src_module("load_raw_to_postgres").main(date=date),
+        src_cmd("load_raw_to_postgres.py", "--date", date),
+        "Load to Postgres failed",
+    )
     context.log.info("Load completed.")
+    return MaterializeResult(metadata=metadata)
 
 
-@op(description="Run dbt transformations and tests")
-def run_dbt_transformations(context):
-    env = os.environ.copy()
+@asset(
+    partitions_def=daily_partitions,
+    deps=[raw_telegram_messages],
+    backfill_policy=BackfillPolicy.single_run(),
+    description="Run dbt transformations and tests (everything not downstream of fct_image_detections)",
+)
+def dbt_marts(context: AssetExecutionContext):
+    # Incremental models pick up whatever was loaded, so a backfill range runs dbt once.
     context.log.info("Running dbt models...")
-    run = run_cmd(
-        [
-            "dbt",
-            "run",
-            "--project-dir",
-            str(PROJECT_DIR),
-            "--profiles-dir",
-            str(PROJECT_DIR),
-        ],
-        cwd=PROJECT_DIR,
-        env=env,
-    )
-    context.log.info(run.stdout)
-    if run.returncode != 0:
-        raise Failure(description="dbt run failed")
-
+    metadata = run_dbt(context, "run", "--exclude", "fct_image_detections+", failure="dbt run failed")
     context.log.info("Running dbt tests...")
-    test = run_cmd(
-        [
-            "dbt",
-            "test",
-            "--project-dir",
-            str(PROJECT_DIR),
-            "--profiles-dir",
-            str(PROJECT_DIR),
-        ],
-        cwd=PROJECT_DIR,
-        env=env,
-    )
-    context.log.info(test.stdout)
-    if test.returncode != 0:
-        raise Failure(description="dbt test failed")
+    metadata.update(run_dbt(context, "test", "--exclude", "fct_image_detections+", failure="dbt test failed"))
+    metadata.update(bump_data_version(context))
     context.log.info("dbt run & test completed.")
+    return MaterializeResult(metadata=metadata)
 
 
-@op(description="Run YOLO detection and load results into Postgres, then refresh image marts")
-def run_yolo_enrichment(context):
-    context.log.info("Running YOLO detections...")
-    detect = run_cmd([sys.executable, str(ROOT / "src" / "yolo_detect.py")], cwd=ROOT)
-    context.log.info(detect.stdout)
-    if detect.returncode != 0:
-        raise Failure(description="YOLO detection failed")
-
+@asset(
+    partitions_def=daily_partitions,
+    deps=[telegram_raw_files],
+    description="Run YOLO detection on the day's images and load results into Postgres",
+)
+def image_detections(context: AssetExecutionContext):
+    date = context.partition_key
+    context.log.info(f"Running YOLO detections for {date}...")
+    metadata = run_step(
+        context,
+        "yolo detect",
+        lambda: src_module("yolo_detect").main(date=date),
+        src_cmd("yolo_detect.py", "--date", date),
+        "YOLO detection failed",
+    )
     context.log.info("Loading YOLO detections into Postgres...")
-    load = run_cmd([sys.executable, str(ROOT / "src" / "load_yolo_to_postgres.py")], cwd=ROOT)
-    context.log.info(load.stdout)
-    if load.returncode != 0:
-        raise Failure(description="Load YOLO detections failed")
+    metadata.update(
+        run_step(
+            context,
+            "load detections",
+            lambda: src_module("load_yolo_to_postgres").main(date=date),
+            src_cmd("load_yolo_to_postgres.py", "--date", date),
+            "Load YOLO detections failed",
+        )
+    )
+    context.log.info("YOLO detection completed.")
+    return MaterializeResult(metadata=metadata)
+
 
-    # Refresh the image detection fact after enrichment
+@asset(
+    partitions_def=daily_partitions,
+    deps=[dbt_marts, image_detections],
+    backfill_policy=BackfillPolicy.single_run(),
+    description="Refresh fct_image_detections and the marts built on it (agg_channel_daily) once messages and detections have both landed",
+)
+def fct_image_detections(context: AssetExecutionContext):
     context.log.info("Refreshing fct_image_detections via dbt...")
-    refresh = run_cmd(
-        [
-            "dbt",
-            "run",
-            "--project-dir",
-            str(PROJECT_DIR),
-            "--profiles-dir",
-            str(PROJECT_DIR),
-            "--select",
-            "fct_image_detections",
-        ],
-        cwd=PROJECT_DIR,
-    )
-    context.log.info(refresh.stdout)
-    if refresh.returncode != 0:
-        raise Failure(description="dbt refresh of fct_image_detections failed")
+    metadata = run_dbt(context, "run", "--select", "fct_image_detections+", failure="dbt refresh of fct_image_detections failed")
+    metadata.update(bump_data_version(context))
     context.log.info("YOLO enrichment completed.")
+    return MaterializeResult(metadata=metadata)
 
 
-@job
-def daily_pipeline_job():
-    # Execution order: scrape -> load -> dbt -> yolo (then selective dbt refresh)
-    run_yolo_enrichment(run_dbt_transformations(load_raw_to_postgres(scrape_telegram_data())))
-
+# Detection runs in parallel with load -> dbt; only fct_image_detections joins them.
+daily_pipeline_job = define_asset_job(
+    "daily_pipeline_job",
+    selection=AssetSelection.all(),
+    partitions_def=daily_partitions,
+    executor_def=in_process_executor if EXECUTOR == "in_process" else multiprocess_executor,
+)
 
-daily_schedule = ScheduleDefinition(
-    job=daily_pipeline_job,
-    cron_schedule="0 2 * * *",  # daily at 02:00 UTC
-    execution_timezone="UTC",
+daily_schedule = build_schedule_from_partitioned_job(
+    daily_pipeline_job,
+    hour_of_day=2,  # daily at 02:00 UTC
 )
 
 
-# Simple failure hook to surface errors (can be extended to send alerts)
-@daily_pipeline_job.failure_hook
-def on_failure(context: HookContext):
-    context.log.error(f"Pipeline failed for run_id={context.run_id}")
+# Simple failure sensor to surface errors (can be extended to send alerts)
+@run_failure_sensor(monitored_jobs=[daily_pipeline_job])
+def on_failure(context: RunFailureSensorContext):
+    context.log.error(f"Pipeline failed for run_id={context.dagster_run.run_id}")
 
 
-definitions = Definitions(jobs=[daily_pipeline_job], schedules=[daily_schedule])
+definitions = Definitions(
+    assets=[telegram_raw_files, raw_telegram_messages, dbt_marts, image_detections, fct_image_detections],
+    jobs=[daily_pipeline_job],
+    schedules=[daily_schedule],
+    sensors=[on_failure],
+)
@@ -0,0 +1,434 @@
+"""Throughput benchmarks for the loaders, YOLO detection and the API.
+
+Generate a synthetic data lake, then time each component against it:
+
+    python scripts/benchmark.py generate --root data/bench --days 7 --messages 2000
+    python scripts/benchmark.py run --root data/bench --api-url http://localhost:8000 --json bench.json
+    python scripts/benchmark.py run --root data/bench --compare bench.json
+    python scripts/benchmark.py runtimes --runtimes onnx onnx-int8 openvino --sample 200
+
+The loaders write into the database configured by the DB_* variables, so
+point DB_NAME at a scratch database. Synthetic channels are prefixed with
+``bench_`` to keep them apart from real data; each run clears the previous
+bench rows and their load manifest entries so the loaders always do a full
+load. The API endpoints read the dbt marts, so run dbt after the first load
+before timing them.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import argparse
+import statistics
+import urllib.request
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+os.environ.setdefault("PIPELINE_METRICS", "false")
+
+WORDS = (
+    "paracetamol amoxicillin vitamin serum sunscreen cream syrup tablets capsules "
+    "insulin bandage mask gloves thermometer lotion shampoo ointment drops available "
+    "price delivery order today new stock pharmacy original imported discount"
+).split()
+
+API_ENDPOINTS = [
+    ("top-products", "/api/reports/top-products?limit=20"),
+    ("channel-activity", "/api/channels/bench_channel_0/activity"),
+    ("search", "/api/search/messages?query=vitamin&limit=50"),
+    ("search-substring", "/api/search/messages?query=vitamin&limit=50&mode=substring"),
+    ("visual-content", "/api/reports/visual-content"),
+]
+
+
+# -------------------- Synthetic data --------------------
+def write_jpeg(path: Path, rng: np.random.Generator, size: int):
+    import cv2
+
+    image = rng.integers(0, 256, size=(size, size, 3), dtype=np.uint8)
+    cv2.imwrite(str(path), image)
+
+
+def generate(root: Path, days: int, channels: int, messages: int, image_ratio: float, image_size: int, seed: int):
+    """Write ``telegram_messages/<date>/*.jsonl``, ``images/<channel>/*.jpg`` and ``yolo_detections/<date>/detections.csv``."""
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+    if root.exists():
+        shutil.rmtree(root)
+
+    start = date.today() - timedelta(days=days - 1)
+    message_id = 0
+    for day in range(days):
+        day_str = (start + timedelta(days=day)).isoformat()
+        day_dir = root / "telegram_messages" / day_str
+        day_dir.mkdir(parents=True, exist_ok=True)
+        detections_dir = root / "yolo_detections" / day_str
+        detections_dir.mkdir(parents=True, exist_ok=True)
+
+        with (detections_dir / "detections.csv").open("w", newline="") as det_file:
+            det_writer = csv.writer(det_file)
+            det_writer.writerow(
+                ["message_id", "channel_name", "image_path", "detected_class", "confidence", "image_category"]
+            )
+            for c in range(channels):
+                channel = f"bench_channel_{c}"
+                image_dir = root / "images" / channel
+                image_dir.mkdir(parents=True, exist_ok=True)
+                with (day_dir / f"{channel}.jsonl").open("w", encoding="utf-8") as f:
+                    for _ in range(messages // channels):
+                        message_id += 1
+                        posted = datetime.combine(start + timedelta(days=day), datetime.min.time(), timezone.utc)
+                        posted += timedelta(seconds=random.randint(0, 86399))
+                        image_path = None
+                        if random.random() < image_ratio:
+                            image_path = image_dir / f"{message_id}.jpg"
+                            write_jpeg(image_path, rng, image_size)
+                            det_writer.writerow(
+                                [message_id, channel, str(image_path), random.choice(["bottle", "person", "cup"]),
+                                 round(random.random(), 4), random.choice(["product_display", "lifestyle", "promotional"])]
+                            )
+                        msg = {
+                            "message_id": message_id,
+                            "channel_name": channel,
+                            "message_date": posted.isoformat(),
+                            "message_text": " ".join(random.choices(WORDS, k=random.randint(5, 40))),
+                            "views": random.randint(0, 20000),
+                            "forwards": random.randint(0, 500),
+                            "has_media": image_path is not None,
+                            "image_path": str(image_path) if image_path else None,
+                        }
+                        f.write(json.dumps(msg) + "\n")
+    print(f"Generated {message_id} messages over {days} days and {channels} channels in {root}")
+
+
+# -------------------- Stub detector --------------------
+class _StubBoxes:
+    def __init__(self, cls: np.ndarray, conf: np.ndarray):
+        self.cls = cls
+        self.conf = conf
+
+    def __len__(self):
+        return len(self.cls)
+
+
+class _StubResult:
+    names = {0: "person", 39: "bottle", 41: "cup"}
+
+    def __init__(self, rng: np.random.Generator):
+        n = int(rng.integers(0, 4))
+        self.boxes = _StubBoxes(
+            rng.choice(list(self.names), size=n).astype(np.float32),
+            rng.random(n).astype(np.float32),
+        )
+
+
+class StubModel:
+    """Stands in for YOLO so the detection pipeline can be timed without weights."""
+
+    def __init__(self, seed: int = 0):
+        self.rng = np.random.default_rng(seed)
+
+    def predict(self, source, conf=0.25, verbose=False):
+        images = source if isinstance(source, list) else [source]
+        return [_StubResult(self.rng) for _ in images]
+
+
+# -------------------- Benchmarks --------------------
+def _spans():
+    import metrics
+
+    return {s.stage: s for s in metrics.drain_completed()}
+
+
+def reset_bench_rows(data_root: Path, table):
+    """Drop earlier bench rows from ``table`` and forget their files in the load manifest.
+
+    Regenerating with the same seed reproduces the same content hashes, so
+    without this every run after the first would skip all files.
+    """
+    from load_manifest import ensure_manifest
+    from partitions import ensure_table
+    from settings import get_connection
+
+    conn = get_connection()
+    cur = conn.cursor()
+    ensure_manifest(cur)
+    ensure_table(cur, table)
+    cur.execute("DELETE FROM raw.load_manifest WHERE file_path LIKE %s;", (f"{data_root}/%",))
+    cur.execute(f"DELETE FROM {table.qualified} WHERE channel_name LIKE %s;", ("bench\\_%",))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def bench_load_raw(root: Path) -> dict:
+    import load_raw_to_postgres
+    from partitions import TELEGRAM_MESSAGES
+
+    load_raw_to_postgres.DATA_PATH = root / "telegram_messages"
+    reset_bench_rows(load_raw_to_postgres.DATA_PATH, TELEGRAM_MESSAGES)
+    started = time.perf_counter()
+    load_raw_to_postgres.main()
+    elapsed = time.perf_counter() - started
+    rows = _spans()["load_raw_messages"].counters.get("rows", 0)
+    return {"seconds": elapsed, "rows": rows, "rows_per_sec": rows / elapsed if elapsed else 0.0}
+
+
+def bench_load_yolo(root: Path) -> dict:
+    import load_yolo_to_postgres
+    from partitions import IMAGE_DETECTIONS
+
+    load_yolo_to_postgres.YOLO_OUTPUT_ROOT = root / "yolo_detections"
+    reset_bench_rows(load_yolo_to_postgres.YOLO_OUTPUT_ROOT, IMAGE_DETECTIONS)
+    started = time.perf_counter()
+    load_yolo_to_postgres.main()
+    elapsed = time.perf_counter() - started
+    rows = _spans()["load_detections"].counters.get("rows", 0)
+    return {"seconds": elapsed, "rows": rows, "rows_per_sec": rows / elapsed if elapsed else 0.0}
+
+
+def bench_detect(root: Path, model: str) -> dict:
+    import yolo_detect
+
+    work = root / "_detect"
+    shutil.rmtree(work, ignore_errors=True)
+    yolo_detect.IMAGE_ROOT = root / "images"
+    yolo_detect.OUTPUT_ROOT = work / "yolo_detections"
+    yolo_detect.CACHE_PATH = work / "cache.sqlite"  # cold cache: every image hits the model
+    if model == "stub":
+        yolo_detect.get_model = lambda *args: StubModel()
+    else:
+        yolo_detect.MODEL_PATH = model
+
+    started = time.perf_counter()
+    yolo_detect.main()
+    elapsed = time.perf_counter() - started
+    images = _spans()["yolo_detect"].counters.get("images", 0)
+    return {"seconds": elapsed, "images": images, "images_per_sec": images / elapsed if elapsed else 0.0}
+
+
+def _percentiles(latencies: list) -> tuple:
+    cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return statistics.median(latencies), cuts[98]
+
+
+def _get_ms(url: str, headers: dict | None = None) -> float:
+    started = time.perf_counter()
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {})) as resp:
+        resp.read()
+    return (time.perf_counter() - started) * 1000
+
+
+def bench_api(base_url: str, requests: int) -> dict:
+    """Latency per endpoint, with the response cache bypassed (miss) and warm (hit)."""
+    results = {}
+    for name, path in API_ENDPOINTS:
+        url = base_url.rstrip("/") + path
+        misses = [_get_ms(url, {"Cache-Control": "no-cache"}) for _ in range(requests)]
+        hits = [_get_ms(url) for _ in range(requests)]
+        miss_p50, miss_p99 = _percentiles(misses)
+        hit_p50, hit_p99 = _percentiles(hits)
+        results[name] = {
+            "miss_p50_ms": miss_p50,
+            "miss_p99_ms": miss_p99,
+            "hit_p50_ms": hit_p50,
+            "hit_p99_ms": hit_p99,
+            "requests": len(misses) + len(hits),
+        }
+    return results
+
+
+# -------------------- Inference runtimes --------------------
+# name -> (yolo_detect runtime, int8)
+RUNTIMES = {
+    "torch": ("torch", False),
+    "onnx": ("onnx", False),
+    "onnx-int8": ("onnx", True),
+    "openvino": ("openvino", False),
+    "openvino-int8": ("openvino", True),
+}
+
+
+def _detections(result):
+    import yolo_detect
+
+    boxes = result.boxes
+    return yolo_detect.as_numpy(boxes.cls).astype(int), yolo_detect.as_numpy(boxes.xyxy).astype(float)
+
+
+def _iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of ``(n, 4)`` and ``(m, 4)`` xyxy boxes."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def box_agreement(base, other, threshold: float = 0.5) -> float:
+    """F1 of greedily matching same-class boxes at IoU >= ``threshold`` (1.0 when both are empty)."""
+    (base_cls, base_xyxy), (other_cls, other_xyxy) = base, other
+    if not len(base_cls) and not len(other_cls):
+        return 1.0
+    if not len(base_cls) or not len(other_cls):
+        return 0.0
+    iou = _iou(base_xyxy, other_xyxy)
+    iou[base_cls[:, None] != other_cls[None, :]] = 0.0
+    matched = 0
+    while True:
+        i, j = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[i, j] < threshold:
+            break
+        matched += 1
+        iou[i, :] = 0.0
+        iou[:, j] = 0.0
+    return 2 * matched / (len(base_cls) + len(other_cls))
+
+
+def bench_runtimes(image_root: Path, names: list, weights: str, sample: int, seed: int) -> dict:
+    """Latency, throughput and agreement with PyTorch for each runtime on sampled images."""
+    import yolo_detect
+    from ultralytics import YOLO
+
+    paths = sorted(path for _, path in yolo_detect.iter_image_files(image_root))
+    paths = random.Random(seed).sample(paths, min(sample, len(paths)))
+    images = [image for image in map(yolo_detect.read_image, paths) if image is not None]
+    if not images:
+        raise SystemExit(f"No readable images under {image_root}")
+
+    names = ["torch"] + [n for n in names if n != "torch"]
+    baseline = None
+    results = {}
+    for name in names:
+        runtime, int8 = RUNTIMES[name]
+        model = YOLO(yolo_detect.runtime_model_path(weights, runtime, int8), task="detect")
+
+        def predict(source):
+            return model.predict(source=source, conf=yolo_detect.CONF_THRESHOLD, verbose=False)
+
+        predict(images[: yolo_detect.BATCH_SIZE])  # warm-up
+
+        latencies, outputs = [], []
+        for image in images:
+            started = time.perf_counter()
+            outputs.append(_detections(predict(image)[0]))
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        for batch in yolo_detect.iter_batches(images, yolo_detect.BATCH_SIZE):
+            predict(batch)
+        elapsed = time.perf_counter() - started
+
+        names_map = model.names
+        categories = [yolo_detect.classify_image({names_map[int(c)] for c in cls}) for cls, _ in outputs]
+        if baseline is None:
+            baseline = (outputs, categories)
+        p50, p99 = _percentiles(latencies)
+        results[name] = {
+            "images": len(images),
+            "p50_ms": p50,
+            "p99_ms": p99,
+            "images_per_sec": len(images) / elapsed if elapsed else 0.0,
+            "box_agreement": float(np.mean([box_agreement(b, o) for b, o in zip(baseline[0], outputs)])),
+            "category_agreement": float(np.mean([b == o for b, o in zip(baseline[1], categories)])),
+        }
+    return results
+
+
+def print_report(report: dict, previous: dict | None):
+    for component, values in report.items():
+        nested = component in ("api", "runtimes")
+        entries = values.items() if nested else [(component, values)]
+        for name, stats in entries:
+            prev = (previous or {}).get(component, {})
+            prev = prev.get(name, {}) if nested else prev
+            parts = []
+            for key, value in stats.items():
+                text = f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                if isinstance(prev.get(key), (int, float)) and prev[key]:
+                    text += f" ({(value - prev[key]) / prev[key]:+.1%})"
+                parts.append(text)
+            print(f"{name:<20} " + "  ".join(parts))
+
+
+def run(args):
+    root = Path(args.root).resolve()
+    os.chdir(ROOT)
+    report = {}
+    if "load_raw" in args.only:
+        report["load_raw"] = bench_load_raw(root)
+    if "load_yolo" in args.only:
+        report["load_yolo"] = bench_load_yolo(root)
+    if "detect" in args.only:
+        report["detect"] = bench_detect(root, args.model)
+    if "api" in args.only and args.api_url:
+        report["api"] = bench_api(args.api_url, args.requests)
+
+    previous = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_report(report, previous)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+
+def run_runtimes(args):
+    os.chdir(ROOT)
+    report = {"runtimes": bench_runtimes(Path(args.images), args.runtimes, args.weights, args.sample, args.seed)}
+    previous = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_report(report, previous)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="write a synthetic data lake")
+    gen.add_argument("--root", default="data/bench")
+    gen.add_argument("--days", type=int, default=7)
+    gen.add_argument("--channels", type=int, default=5)
+    gen.add_argument("--messages", type=int, default=2000, help="messages per day across all channels")
+    gen.add_argument("--image-ratio", type=float, default=0.3)
+    gen.add_argument("--image-size", type=int, default=320)
+    gen.add_argument("--seed", type=int, default=0)
+
+    bench = sub.add_parser("run", help="time loaders, detection and API endpoints")
+    bench.add_argument("--root", default="data/bench")
+    bench.add_argument("--only", nargs="+", default=["load_raw", "load_yolo", "detect", "api"],
+                       choices=["load_raw", "load_yolo", "detect", "api"])
+    bench.add_argument("--model", default="stub", help="'stub' or a YOLO weights path such as yolov8n.pt")
+    bench.add_argument("--api-url", help="base URL of a running API, e.g. http://localhost:8000")
+    bench.add_argument("--requests", type=int, default=50, help="requests per API endpoint")
+    bench.add_argument("--json", help="write the report here for later --compare")
+    bench.add_argument("--compare", help="previous --json report to diff against")
+
+    rt = sub.add_parser("runtimes", help="compare inference runtimes against PyTorch on sample images")
+    rt.add_argument("--images", default="data/raw/images")
+    rt.add_argument("--runtimes", nargs="+", default=["onnx"], choices=sorted(RUNTIMES))
+    rt.add_argument("--weights", default="yolov8n.pt")
+    rt.add_argument("--sample", type=int, default=100, help="images sampled from --images")
+    rt.add_argument("--seed", type=int, default=0)
+    rt.add_argument("--json", help="write the report here for later --compare")
+    rt.add_argument("--compare", help="previous --json report to diff against")
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        generate(Path(args.root), args.days, args.channels, args.messages, args.image_ratio, args.image_size, args.seed)
+    elif args.command == "runtimes":
+        run_runtimes(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
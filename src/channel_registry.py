@@ -0,0 +1,60 @@
+import os
+import json
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+CHANNELS_FILE = Path(os.getenv("SCRAPER_CHANNELS_FILE", "config/channels.json"))
+# Slack on each channel's schedule, so a daily cron that fires a little earlier
+# than yesterday's run started still picks the channel up
+SCHEDULE_TOLERANCE_MINUTES = float(os.getenv("SCRAPER_SCHEDULE_TOLERANCE_MINUTES", "60"))
+
+
+@dataclass(frozen=True)
+class Channel:
+    name: str
+    url: str
+    # Higher priority channels are scraped first within a session
+    priority: int = 0
+    # Minimum hours between scrapes of this channel
+    schedule_hours: float = 24
+    enabled: bool = True
+
+
+def load_channels(path: Path = CHANNELS_FILE) -> list:
+    """Enabled channels from the JSON registry, highest priority first."""
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    channels = [Channel(**entry) for entry in entries]
+    names = [c.name for c in channels]
+    duplicates = {n for n in names if names.count(n) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate channel names in {path}: {sorted(duplicates)}")
+    return sorted((c for c in channels if c.enabled), key=lambda c: (-c.priority, c.name))
+
+
+def is_due(
+    channel: Channel,
+    last_scraped_at: str | None,
+    now: datetime,
+    tolerance: timedelta = timedelta(minutes=SCHEDULE_TOLERANCE_MINUTES),
+) -> bool:
+    """Whether ``channel`` should be scraped at ``now``.
+
+    ``last_scraped_at`` is when the previous scrape of the channel started.
+    """
+    if not last_scraped_at:
+        return True
+    return datetime.fromisoformat(last_scraped_at) + timedelta(hours=channel.schedule_hours) - tolerance <= now
+
+
+def shard(channels: list, n: int) -> list:
+    """Split channels into ``n`` shards, dealing them out in priority order.
+
+    Every shard gets a share of the high-priority channels instead of one
+    session carrying all of them.
+    """
+    shards = [[] for _ in range(max(n, 1))]
+    for i, channel in enumerate(sorted(channels, key=lambda c: (-c.priority, c.name))):
+        shards[i % len(shards)].append(channel)
+    return shards
@@ -0,0 +1,42 @@
+import uuid
+
+from settings import get_connection
+
+# Single-row table; the API keys its response cache on this stamp.
+DDL = """
+CREATE SCHEMA IF NOT EXISTS meta;
+CREATE TABLE IF NOT EXISTS meta.data_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version TEXT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+BUMP_SQL = """
+INSERT INTO meta.data_version (id, version, updated_at)
+VALUES (TRUE, %s, now())
+ON CONFLICT (id) DO UPDATE
+SET version = EXCLUDED.version,
+    updated_at = EXCLUDED.updated_at;
+"""
+
+
+def bump_data_version(cursor) -> str:
+    version = uuid.uuid4().hex
+    cursor.execute(DDL)
+    cursor.execute(BUMP_SQL, (version,))
+    return version
+
+
+def main():
+    conn = get_connection()
+    cur = conn.cursor()
+    version = bump_data_version(cur)
+    conn.commit()
+    print(f"Data version bumped to {version}")
+    cur.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
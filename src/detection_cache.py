@@ -0,0 +1,90 @@
+import json
+import sqlite3
+import hashlib
+from pathlib import Path
+
+DDL = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS detections (
+    content_hash TEXT NOT NULL,
+    model_path TEXT NOT NULL,
+    conf REAL NOT NULL,
+    detections TEXT NOT NULL,
+    PRIMARY KEY (content_hash, model_path, conf)
+);
+"""
+
+# Fields of a detection row that depend only on image content, not on where it was posted.
+CACHED_FIELDS = ("detected_class", "confidence", "image_category")
+
+
+def content_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class DetectionCache:
+    """Persistent YOLO results keyed by image content hash, model path and ``conf``.
+
+    File hashes are memoised by ``(path, size, mtime)`` so unchanged images are
+    not re-read on every run.
+    """
+
+    def __init__(self, db_path: Path, model_path: str, conf: float):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(db_path))
+        self.conn.executescript(DDL)
+        self.model_path = str(model_path)
+        self.conf = float(conf)
+
+    def content_hash(self, path: Path) -> str:
+        stat = path.stat()
+        row = self.conn.execute(
+            "SELECT size, mtime, content_hash FROM files WHERE path = ?", (str(path),)
+        ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+
+        digest = content_digest(path.read_bytes())
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime, content_hash) VALUES (?, ?, ?, ?)",
+            (str(path), stat.st_size, stat.st_mtime, digest),
+        )
+        return digest
+
+    def get(self, content_hash: str):
+        row = self.conn.execute(
+            "SELECT detections FROM detections WHERE content_hash = ? AND model_path = ? AND conf = ?",
+            (content_hash, self.model_path, self.conf),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, content_hash: str, rows: list):
+        entries = [[row[field] for field in CACHED_FIELDS] for row in rows]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO detections (content_hash, model_path, conf, detections) VALUES (?, ?, ?, ?)",
+            (content_hash, self.model_path, self.conf, json.dumps(entries)),
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def rows_from_cache(message_id, channel_name: str, img_path: Path, entries: list) -> list:
+    return [
+        {
+            "message_id": message_id,
+            "channel_name": channel_name,
+            "image_path": str(img_path),
+            **dict(zip(CACHED_FIELDS, entry)),
+        }
+        for entry in entries
+    ]
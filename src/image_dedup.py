@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+INDEX_PATH = Path(os.getenv("DEDUP_INDEX_PATH", "data/raw/images/phash_index.sqlite"))
+# Hamming distance at or below which two images count as the same photo. The
+# 64-bit hash is split into four 16-bit bands, so any match within 3 bits shares
+# at least one band exactly and is found by an indexed lookup.
+MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "3"))
+BANDS = 4
+
+DDL = """
+CREATE TABLE IF NOT EXISTS canonical (
+    image_path TEXT PRIMARY KEY,
+    hash INTEGER NOT NULL,
+    b0 INTEGER NOT NULL,
+    b1 INTEGER NOT NULL,
+    b2 INTEGER NOT NULL,
+    b3 INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS canonical_b0 ON canonical (b0);
+CREATE INDEX IF NOT EXISTS canonical_b1 ON canonical (b1);
+CREATE INDEX IF NOT EXISTS canonical_b2 ON canonical (b2);
+CREATE INDEX IF NOT EXISTS canonical_b3 ON canonical (b3);
+CREATE TABLE IF NOT EXISTS duplicates (
+    channel_name TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    canonical_path TEXT NOT NULL,
+    distance INTEGER NOT NULL,
+    PRIMARY KEY (channel_name, message_id)
+);
+CREATE INDEX IF NOT EXISTS duplicates_canonical ON duplicates (canonical_path);
+"""
+
+
+def dhash(path: Path, size: int = 8) -> int:
+    """64-bit difference hash: brightness gradients of a 9x8 greyscale thumbnail."""
+    with Image.open(path) as img:
+        pixels = list(img.convert("L").resize((size + 1, size), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def _bands(value: int) -> list:
+    return [(value >> (16 * i)) & 0xFFFF for i in range(BANDS)]
+
+
+def _signed(value: int) -> int:
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class PhashIndex:
+    """Canonical images by perceptual hash, plus messages that reuse them."""
+
+    def __init__(self, db_path: Path = INDEX_PATH):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Sharded scraper sessions share the index; wait out each other's writes
+        # Media workers hash on worker threads; the lock keeps each lookup and
+        # insert together so two copies of one photo cannot both become canonical
+        self.conn = sqlite3.connect(str(db_path), timeout=30, check_same_thread=False)
+        self.conn.executescript(DDL)
+        self.lock = threading.Lock()
+
+    def find(self, value: int, max_distance: int = MAX_DISTANCE):
+        """Return ``(canonical_path, distance)`` of the closest match, or ``None``."""
+        bands = _bands(value)
+        rows = self.conn.execute(
+            "SELECT image_path, hash FROM canonical WHERE b0 = ? OR b1 = ? OR b2 = ? OR b3 = ?",
+            bands,
+        ).fetchall()
+        best = None
+        for image_path, stored in rows:
+            distance = bin(_unsigned(stored) ^ value).count("1")
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (image_path, distance)
+        return best
+
+    def add_canonical(self, image_path: str, value: int):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO canonical (image_path, hash, b0, b1, b2, b3) VALUES (?, ?, ?, ?, ?, ?)",
+            (image_path, _signed(value), *_bands(value)),
+        )
+        self.conn.commit()
+
+    def add_duplicate(self, channel_name: str, message_id: int, canonical_path: str, distance: int):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO duplicates (channel_name, message_id, canonical_path, distance) VALUES (?, ?, ?, ?)",
+            (channel_name, message_id, canonical_path, distance),
+        )
+        self.conn.commit()
+
+    def aliases(self) -> dict:
+        """``canonical_path -> [(channel_name, message_id), ...]`` for every recorded duplicate."""
+        result = {}
+        for channel_name, message_id, canonical_path in self.conn.execute(
+            "SELECT channel_name, message_id, canonical_path FROM duplicates"
+        ):
+            result.setdefault(canonical_path, []).append((channel_name, message_id))
+        return result
+
+    def close(self):
+        # Waits for a hash still running on a cancelled worker's thread
+        with self.lock:
+            self.conn.close()
+
+
+def dedupe_download(index: PhashIndex, channel_name: str, message_id: int, image_file: Path) -> str:
+    """Register a freshly downloaded image and return the path its message should reference.
+
+    Near-duplicates of an existing canonical image are deleted and recorded as
+    references to it; anything else becomes a new canonical image.
+    """
+    value = dhash(image_file)
+    with index.lock:
+        match = index.find(value)
+        if match and match[0] != str(image_file) and Path(match[0]).exists():
+            canonical_path, distance = match
+            image_file.unlink()
+            index.add_duplicate(channel_name, message_id, canonical_path, distance)
+            return canonical_path
+        index.add_canonical(str(image_file), value)
+    return str(image_file)
@@ -0,0 +1,78 @@
+import hashlib
+from pathlib import Path
+
+DDL_MANIFEST = """
+CREATE SCHEMA IF NOT EXISTS raw;
+CREATE TABLE IF NOT EXISTS raw.load_manifest (
+    file_path TEXT PRIMARY KEY,
+    file_size BIGINT NOT NULL,
+    file_mtime DOUBLE PRECISION NOT NULL,
+    content_hash TEXT NOT NULL,
+    rows_loaded BIGINT NOT NULL,
+    loaded_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+SELECT_SQL = """
+SELECT file_size, file_mtime, content_hash
+FROM raw.load_manifest
+WHERE file_path = %s;
+"""
+
+UPSERT_SQL = """
+INSERT INTO raw.load_manifest (file_path, file_size, file_mtime, content_hash, rows_loaded, loaded_at)
+VALUES (%s, %s, %s, %s, %s, now())
+ON CONFLICT (file_path) DO UPDATE
+SET file_size = EXCLUDED.file_size,
+    file_mtime = EXCLUDED.file_mtime,
+    content_hash = EXCLUDED.content_hash,
+    rows_loaded = EXCLUDED.rows_loaded,
+    loaded_at = EXCLUDED.loaded_at;
+"""
+
+# Only the stat fields change when a file is touched but not rewritten.
+TOUCH_SQL = """
+UPDATE raw.load_manifest
+SET file_size = %s, file_mtime = %s
+WHERE file_path = %s;
+"""
+
+
+def ensure_manifest(cursor):
+    cursor.execute(DDL_MANIFEST)
+
+
+def file_hash(path: Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def needs_load(cursor, path: Path):
+    """Return ``(should_load, state)`` for ``path``.
+
+    Files whose size and mtime match the manifest are skipped without being
+    opened. When the stat changed the content is hashed, and a file with an
+    unchanged hash is only re-stamped in the manifest. ``state`` is the
+    ``(size, mtime, content_hash)`` observed here and is what
+    :func:`record_load` stores, so a file rewritten mid-load is picked up again
+    on the next run.
+    """
+    stat = path.stat()
+    cursor.execute(SELECT_SQL, (str(path),))
+    row = cursor.fetchone()
+    if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+        return False, (stat.st_size, stat.st_mtime, row[2])
+
+    digest = file_hash(path)
+    if row and row[2] == digest:
+        cursor.execute(TOUCH_SQL, (stat.st_size, stat.st_mtime, str(path)))
+        return False, (stat.st_size, stat.st_mtime, digest)
+    return True, (stat.st_size, stat.st_mtime, digest)
+
+
+def record_load(cursor, path: Path, state, rows_loaded: int):
+    size, mtime, digest = state
+    cursor.execute(UPSERT_SQL, (str(path), size, mtime, digest, rows_loaded))
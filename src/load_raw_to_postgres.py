@@ -1,57 +1,189 @@
-import os
-import json
-import psycopg2
+import io
+import csv
+import time
+import argparse
+from itertools import islice
 from pathlib import Path
-from dotenv import load_dotenv
 
-load_dotenv()
+import metrics
+from load_manifest import ensure_manifest, needs_load, record_load
+from partitions import TELEGRAM_MESSAGES, ensure_partitions, ensure_table, lock_table, month_expr
+from raw_io import arrow_csv_buffer, iter_raw_files, iter_record_batches, iter_records
+from settings import get_connection
 
 DATA_PATH = Path("data/raw/telegram_messages")
 
-conn = psycopg2.connect(
-    host=os.getenv("DB_HOST"),
-    port=os.getenv("DB_PORT"),
-    dbname=os.getenv("DB_NAME"),
-    user=os.getenv("DB_USER"),
-    password=os.getenv("DB_PASSWORD"),
-)
-cursor = conn.cursor()
-
-insert_sql = """
-INSERT INTO raw.telegram_messages (
-    message_id,
-    channel_name,
-    message_date,
-    message_text,
-    views,
-    forwards,
-    has_media,
-    image_path
+# Rows buffered per COPY so large files load in constant memory
+COPY_BATCH_SIZE = 10_000
+
+COLUMNS = [
+    "message_id",
+    "channel_name",
+    "message_date",
+    "message_text",
+    "views",
+    "forwards",
+    "has_media",
+    "image_path",
+]
+
+# Session-local staging table; COPY lands here before the merge. ``ordinal``
+# numbers rows in file order, so when a file holds a message more than once
+# (appended reruns, retried photo downloads) the last record wins.
+DDL_STAGE = """
+CREATE TEMP TABLE IF NOT EXISTS telegram_messages_stage (
+    LIKE raw.telegram_messages INCLUDING DEFAULTS,
+    ordinal BIGSERIAL
+) ON COMMIT DELETE ROWS;
+"""
+
+NULL_MARKER = r"\N"
+
+COPY_SQL = f"""
+COPY telegram_messages_stage ({", ".join(COLUMNS)})
+FROM STDIN WITH (FORMAT csv, NULL '{NULL_MARKER}')
+"""
+
+# Months present in the staged rows, so their partitions exist before the merge
+STAGE_MONTHS_SQL = f"""
+SELECT DISTINCT {month_expr(TELEGRAM_MESSAGES)}
+FROM telegram_messages_stage
+WHERE message_date IS NOT NULL;
+"""
+
+# Arrow quotes every non-null value, so the default NULL (unquoted empty) is unambiguous
+COPY_ARROW_SQL = f"""
+COPY telegram_messages_stage ({", ".join(COLUMNS)})
+FROM STDIN WITH (FORMAT csv)
+"""
+
+# Merge staged rows on (channel_name, message_id), keeping each message's last
+# record: refresh existing rows (views/forwards change between scrapes) and
+# insert the rest once.
+UPDATE_SQL = """
+UPDATE raw.telegram_messages t
+SET message_date = s.message_date,
+    message_text = s.message_text,
+    views = s.views,
+    forwards = s.forwards,
+    has_media = s.has_media,
+    image_path = s.image_path,
+    loaded_at = now()
+FROM (
+    SELECT DISTINCT ON (channel_name, message_id) *
+    FROM telegram_messages_stage
+    ORDER BY channel_name, message_id, ordinal DESC
+) s
+WHERE t.channel_name = s.channel_name
+  AND t.message_id = s.message_id;
+"""
+
+INSERT_SQL = f"""
+INSERT INTO raw.telegram_messages ({", ".join(COLUMNS)})
+SELECT DISTINCT ON (s.channel_name, s.message_id) {", ".join("s." + c for c in COLUMNS)}
+FROM telegram_messages_stage s
+WHERE NOT EXISTS (
+    SELECT 1
+    FROM raw.telegram_messages t
+    WHERE t.channel_name = s.channel_name
+      AND t.message_id = s.message_id
 )
-VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+ORDER BY s.channel_name, s.message_id, s.ordinal DESC;
 """
 
-for date_dir in DATA_PATH.iterdir():
-    if date_dir.is_dir():
-        for json_file in date_dir.glob("*.json"):
-            with open(json_file, "r", encoding="utf-8") as f:
-                messages = json.load(f)
-
-            for msg in messages:
-                cursor.execute(
-                    insert_sql,
-                    (
-                        msg["message_id"],
-                        msg["channel_name"],
-                        msg["message_date"],
-                        msg["message_text"],
-                        msg["views"],
-                        msg["forwards"],
-                        msg["has_media"],
-                        msg["image_path"],
-                    ),
-                )
-
-conn.commit()
-cursor.close()
-conn.close()
+
+def find_raw_files(root: Path, date: str | None = None):
+    date_dirs = [root / date] if date else sorted(root.iterdir())
+    for date_dir in date_dirs:
+        if date_dir.is_dir():
+            yield from iter_raw_files(date_dir)
+
+
+def to_csv_buffer(messages) -> tuple[io.StringIO, int]:
+    """Serialise messages into an in-memory CSV buffer suitable for COPY.
+
+    ``None`` is written as an explicit NULL marker so empty message texts stay
+    empty strings rather than collapsing to NULL.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    count = 0
+    for msg in messages:
+        writer.writerow([NULL_MARKER if msg.get(c) is None else msg[c] for c in COLUMNS])
+        count += 1
+    buf.seek(0)
+    return buf, count
+
+
+def copy_parquet(cursor, raw_file: Path) -> int:
+    """COPY a Parquet part in Arrow record batches, without building Python dicts."""
+    total = 0
+    for batch in iter_record_batches(raw_file, COLUMNS, COPY_BATCH_SIZE):
+        cursor.copy_expert(COPY_ARROW_SQL, arrow_csv_buffer(batch))
+        total += batch.num_rows
+    return total
+
+
+def load_file(cursor, raw_file: Path) -> int:
+    if raw_file.suffix == ".parquet":
+        total = copy_parquet(cursor, raw_file)
+    else:
+        records = iter_records(raw_file)
+        total = 0
+        while True:
+            buf, count = to_csv_buffer(islice(records, COPY_BATCH_SIZE))
+            if not count:
+                break
+            cursor.copy_expert(COPY_SQL, buf)
+            total += count
+    # Held until the file's commit, so overlapping loads merge one at a time
+    lock_table(cursor, TELEGRAM_MESSAGES)
+    cursor.execute(STAGE_MONTHS_SQL)
+    ensure_partitions(cursor, TELEGRAM_MESSAGES, [row[0] for row in cursor.fetchall()])
+    cursor.execute(UPDATE_SQL)
+    cursor.execute(INSERT_SQL)
+    return total
+
+
+def main(date: str | None = None):
+    with metrics.span("load_raw_messages"):
+        conn = get_connection()
+        cur = conn.cursor()
+
+        ensure_table(cur, TELEGRAM_MESSAGES)
+        cur.execute(DDL_STAGE)
+        ensure_manifest(cur)
+        conn.commit()
+
+        total_rows = 0
+        skipped = 0
+        started = time.perf_counter()
+        for raw_file in find_raw_files(DATA_PATH, date):
+            should_load, state = needs_load(cur, raw_file)
+            if not should_load:
+                conn.commit()
+                skipped += 1
+                metrics.count("files_skipped")
+                continue
+            rows = load_file(cur, raw_file)
+            record_load(cur, raw_file, state, rows)
+            conn.commit()
+            total_rows += rows
+            metrics.count("files")
+            metrics.count("rows", rows)
+            metrics.count("bytes", state[0])
+            print(f"Loaded {rows} messages from {raw_file}")
+
+        elapsed = time.perf_counter() - started
+        rate = total_rows / elapsed if elapsed > 0 else 0.0
+        print(f"Loaded {total_rows} messages in {elapsed:.2f}s ({rate:.0f} rows/sec); skipped {skipped} unchanged files")
+
+        cur.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load raw Telegram messages into Postgres")
+    parser.add_argument("--date", help="only load data/raw/telegram_messages/<date> (YYYY-MM-DD)")
+    args = parser.parse_args()
+    main(date=args.date)
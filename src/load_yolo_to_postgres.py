@@ -1,28 +1,29 @@
-import os
 import csv
+import argparse
+from datetime import date
 from pathlib import Path
-import psycopg2
-from dotenv import load_dotenv
+import pyarrow as pa
 
-load_dotenv()
+import metrics
+from load_manifest import ensure_manifest, needs_load, record_load
+from partitions import IMAGE_DETECTIONS, ensure_partitions, ensure_table, lock_table
+from raw_io import arrow_csv_buffer, iter_record_batches
+from settings import get_connection
 
 YOLO_OUTPUT_ROOT = Path("data/raw/yolo_detections")
 
-DDL_SCHEMA = """
-CREATE SCHEMA IF NOT EXISTS raw;
-"""
+# Rows per Arrow record batch when loading Parquet detections
+COPY_BATCH_SIZE = 10_000
 
-DDL_TABLE = """
-CREATE TABLE IF NOT EXISTS raw.image_detections (
-    message_id BIGINT,
-    channel_name TEXT,
-    image_path TEXT,
-    detected_class TEXT,
-    confidence NUMERIC,
-    image_category TEXT,
-    detection_date DATE DEFAULT CURRENT_DATE
-);
-"""
+COLUMNS = [
+    "message_id",
+    "channel_name",
+    "image_path",
+    "detected_class",
+    "confidence",
+    "image_category",
+    "detection_date",
+]
 
 INSERT_SQL = """
 INSERT INTO raw.image_detections (
@@ -37,26 +38,56 @@ INSERT INTO raw.image_detections (
 """
 
 
-def get_connection():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT"),
-        dbname=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-    )
+# A day's detections.csv is rewritten whole, so a changed file replaces that day;
+# the delete only touches that day's monthly partition.
+DELETE_DAY_SQL = """
+DELETE FROM raw.image_detections WHERE detection_date = %s;
+"""
+
+# Parquet output is split per channel: <date>/<channel>/detections.parquet
+DELETE_DAY_CHANNEL_SQL = """
+DELETE FROM raw.image_detections WHERE detection_date = %s AND channel_name = %s;
+"""
+
+COPY_SQL = f"""
+COPY raw.image_detections ({", ".join(COLUMNS)})
+FROM STDIN WITH (FORMAT csv)
+"""
 
 
-def find_csv_files(root: Path):
-    for day_dir in sorted(root.iterdir()):
+def find_detection_files(root: Path, date: str | None = None):
+    day_dirs = [root / date] if date else sorted(root.iterdir())
+    for day_dir in day_dirs:
         if day_dir.is_dir():
             csv_path = day_dir / "detections.csv"
             if csv_path.exists():
                 yield csv_path
-
-
-def load_file(cursor, csv_path: Path):
+            yield from sorted(day_dir.glob("*/detections.parquet"))
+
+
+def load_parquet(cursor, parquet_path: Path) -> int:
+    detection_date = parquet_path.parent.parent.name  # YYYY-MM-DD
+    ensure_partitions(cursor, IMAGE_DETECTIONS, [date.fromisoformat(detection_date)])
+    cursor.execute(DELETE_DAY_CHANNEL_SQL, (detection_date, parquet_path.parent.name))
+    rows = 0
+    for batch in iter_record_batches(parquet_path, COLUMNS[:-1], COPY_BATCH_SIZE):
+        table = pa.Table.from_batches([batch]).append_column(
+            "detection_date", pa.array([detection_date] * batch.num_rows, pa.string())
+        )
+        cursor.copy_expert(COPY_SQL, arrow_csv_buffer(table))
+        rows += batch.num_rows
+    return rows
+
+
+def load_file(cursor, csv_path: Path) -> int:
+    # Concurrent per-day loads would otherwise race on creating the same month's partition
+    lock_table(cursor, IMAGE_DETECTIONS)
+    if csv_path.suffix == ".parquet":
+        return load_parquet(cursor, csv_path)
     detection_date = csv_path.parent.name  # YYYY-MM-DD
+    ensure_partitions(cursor, IMAGE_DETECTIONS, [date.fromisoformat(detection_date)])
+    cursor.execute(DELETE_DAY_SQL, (detection_date,))
+    rows = 0
     with csv_path.open() as f:
         reader = csv.DictReader(f)
         for row in reader:
@@ -72,24 +103,42 @@ def load_file(cursor, csv_path: Path):
                     detection_date,
                 ),
             )
+            rows += 1
+    return rows
 
 
-def main():
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute(DDL_SCHEMA)
-    cur.execute(DDL_TABLE)
-    conn.commit()
+def main(date: str | None = None):
+    with metrics.span("load_detections"):
+        conn = get_connection()
+        cur = conn.cursor()
 
-    for csv_file in find_csv_files(YOLO_OUTPUT_ROOT):
-        load_file(cur, csv_file)
+        ensure_table(cur, IMAGE_DETECTIONS)
+        ensure_manifest(cur)
         conn.commit()
-        print(f"Loaded {csv_file}")
 
-    cur.close()
-    conn.close()
+        skipped = 0
+        for detection_file in find_detection_files(YOLO_OUTPUT_ROOT, date):
+            should_load, state = needs_load(cur, detection_file)
+            if not should_load:
+                conn.commit()
+                skipped += 1
+                metrics.count("files_skipped")
+                continue
+            rows = load_file(cur, detection_file)
+            record_load(cur, detection_file, state, rows)
+            conn.commit()
+            metrics.count("files")
+            metrics.count("rows", rows)
+            metrics.count("bytes", state[0])
+            print(f"Loaded {detection_file}")
+        print(f"Skipped {skipped} unchanged files")
+
+        cur.close()
+        conn.close()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Load YOLO detections into Postgres")
+    parser.add_argument("--date", help="only load data/raw/yolo_detections/<date> (YYYY-MM-DD)")
+    args = parser.parse_args()
+    main(date=args.date)
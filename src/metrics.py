@@ -0,0 +1,122 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from settings import env_flag, get_connection
+
+load_dotenv()
+
+# Set by the pipeline (env for subprocess steps, set_run_id in-process)
+RUN_ID = os.getenv("PIPELINE_RUN_ID")
+# PIPELINE_METRICS=false keeps spans in memory/logs only
+PERSIST = env_flag("PIPELINE_METRICS", True)
+
+DDL = """
+CREATE SCHEMA IF NOT EXISTS meta;
+CREATE TABLE IF NOT EXISTS meta.pipeline_runs (
+    id BIGSERIAL PRIMARY KEY,
+    run_id TEXT,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started_at TIMESTAMPTZ NOT NULL,
+    finished_at TIMESTAMPTZ NOT NULL,
+    duration_seconds DOUBLE PRECISION NOT NULL,
+    counters JSONB NOT NULL DEFAULT '{}'::jsonb
+);
+CREATE INDEX IF NOT EXISTS pipeline_runs_stage_idx ON meta.pipeline_runs (stage, started_at);
+"""
+
+INSERT_SQL = """
+INSERT INTO meta.pipeline_runs (run_id, stage, status, started_at, finished_at, duration_seconds, counters)
+VALUES (%s, %s, %s, %s, %s, %s, %s);
+"""
+
+
+@dataclass
+class Span:
+    stage: str
+    run_id: Optional[str]
+    started_at: datetime
+    counters: dict = field(default_factory=dict)
+    status: str = "running"
+    finished_at: Optional[datetime] = None
+    duration_seconds: float = 0.0
+
+
+_active: ContextVar[Optional[Span]] = ContextVar("metrics_span", default=None)
+_completed: list = []
+
+
+def set_run_id(run_id: Optional[str]):
+    global RUN_ID
+    RUN_ID = run_id
+
+
+def count(name: str, value=1):
+    """Add ``value`` to counter ``name`` on the innermost active span (no-op outside one)."""
+    current = _active.get()
+    if current is not None:
+        current.counters[name] = current.counters.get(name, 0) + value
+
+
+def drain_completed() -> list:
+    """Return and forget the spans finished in this process so far."""
+    spans = list(_completed)
+    _completed.clear()
+    return spans
+
+
+def record_span(s: Span):
+    try:
+        conn = get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(DDL)
+                cur.execute(
+                    INSERT_SQL,
+                    (
+                        s.run_id,
+                        s.stage,
+                        s.status,
+                        s.started_at,
+                        s.finished_at,
+                        s.duration_seconds,
+                        json.dumps(s.counters),
+                    ),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        # Metrics must never fail the stage they measure
+        logger.warning("Could not record metrics for {}: {}", s.stage, e)
+
+
+@contextmanager
+def span(stage: str, persist: bool = PERSIST):
+    """Time a pipeline stage and collect counters; persisted to ``meta.pipeline_runs``."""
+    s = Span(stage=stage, run_id=RUN_ID, started_at=datetime.now(timezone.utc))
+    token = _active.set(s)
+    started = time.perf_counter()
+    try:
+        yield s
+        s.status = "success"
+    except BaseException:
+        s.status = "failed"
+        raise
+    finally:
+        _active.reset(token)
+        s.duration_seconds = time.perf_counter() - started
+        s.finished_at = datetime.now(timezone.utc)
+        logger.info("[metrics] {} {} in {:.2f}s {}", s.stage, s.status, s.duration_seconds, s.counters)
+        _completed.append(s)
+        if persist:
+            record_span(s)
@@ -0,0 +1,312 @@
+"""Monthly range partitioning and retention for the raw tables.
+
+The loaders call ``ensure_table`` / ``ensure_partitions`` themselves; this
+script is for scheduled maintenance:
+
+    python src/partitions.py premake --months-ahead 3
+    python src/partitions.py retain --keep-months 24 [--drop]
+"""
+import os
+import re
+import argparse
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+
+from dotenv import load_dotenv
+
+from settings import get_connection
+
+load_dotenv()
+
+# Partitions created ahead of the current month so loads never wait on DDL
+PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "2"))
+RETENTION_MONTHS = int(os.getenv("RAW_RETENTION_MONTHS", "24"))
+
+PARTITION_NAME = re.compile(r"_p(\d{4})_(\d{2})$")
+
+
+@dataclass(frozen=True)
+class PartitionedTable:
+    schema: str
+    name: str
+    columns: str
+    key: str
+    # Postgres type of ``key``; timestamptz bounds are pinned to UTC
+    key_type: str
+    indexes: tuple = ()
+
+    @property
+    def qualified(self) -> str:
+        return f"{self.schema}.{self.name}"
+
+
+TELEGRAM_MESSAGES = PartitionedTable(
+    schema="raw",
+    name="telegram_messages",
+    columns="""
+    message_id BIGINT,
+    channel_name TEXT,
+    message_date TIMESTAMPTZ,
+    message_text TEXT,
+    views INTEGER,
+    forwards INTEGER,
+    has_media BOOLEAN,
+    image_path TEXT,
+    loaded_at TIMESTAMPTZ DEFAULT now()
+    """,
+    key="message_date",
+    key_type="timestamptz",
+    indexes=(
+        ("telegram_messages_channel_message_idx", "channel_name, message_id"),
+        ("telegram_messages_loaded_at_idx", "loaded_at"),
+    ),
+)
+
+IMAGE_DETECTIONS = PartitionedTable(
+    schema="raw",
+    name="image_detections",
+    columns="""
+    message_id BIGINT,
+    channel_name TEXT,
+    image_path TEXT,
+    detected_class TEXT,
+    confidence NUMERIC,
+    image_category TEXT,
+    detection_date DATE DEFAULT CURRENT_DATE,
+    loaded_at TIMESTAMPTZ DEFAULT now()
+    """,
+    key="detection_date",
+    key_type="date",
+    indexes=(
+        ("image_detections_channel_message_idx", "channel_name, message_id"),
+        ("image_detections_loaded_at_idx", "loaded_at"),
+    ),
+)
+
+TABLES = {t.qualified: t for t in (TELEGRAM_MESSAGES, IMAGE_DETECTIONS)}
+
+
+def month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def add_months(d: date, n: int) -> date:
+    years, month = divmod(d.month - 1 + n, 12)
+    return date(d.year + years, month + 1, 1)
+
+
+def partition_name(table: PartitionedTable, month: date) -> str:
+    return f"{table.name}_p{month:%Y_%m}"
+
+
+def _bound(table: PartitionedTable, d: date) -> str:
+    return f"'{d.isoformat()} 00:00:00+00'" if table.key_type == "timestamptz" else f"'{d.isoformat()}'"
+
+
+def month_expr(table: PartitionedTable) -> str:
+    """SQL for the first day of the month of ``table.key`` (UTC for timestamptz)."""
+    key = f"{table.key} AT TIME ZONE 'UTC'" if table.key_type == "timestamptz" else table.key
+    return f"date_trunc('month', {key})::date"
+
+
+def _relkind(cursor, table: PartitionedTable):
+    cursor.execute(
+        """
+        SELECT c.relkind
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s
+        """,
+        (table.schema, table.name),
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def dependent_views(cursor, table: PartitionedTable) -> list:
+    """``(qualified_name, relkind, definition)`` of views built on ``table``, dependencies first.
+
+    Covers views on those views too (dbt staging models and anything on top of
+    them), so they can be recreated after the table is replaced.
+    """
+    cursor.execute(
+        """
+        WITH RECURSIVE deps AS (
+            SELECT r.ev_class AS oid, 1 AS depth
+            FROM pg_depend d
+            JOIN pg_rewrite r ON r.oid = d.objid
+            WHERE d.refobjid = %s::regclass AND r.ev_class <> d.refobjid
+            UNION ALL
+            SELECT r.ev_class, deps.depth + 1
+            FROM deps
+            JOIN pg_depend d ON d.refobjid = deps.oid
+            JOIN pg_rewrite r ON r.oid = d.objid
+            WHERE r.ev_class <> d.refobjid
+        )
+        SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname), c.relkind, pg_get_viewdef(c.oid)
+        FROM deps
+        JOIN pg_class c ON c.oid = deps.oid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        GROUP BY c.oid, n.nspname, c.relname, c.relkind
+        ORDER BY max(deps.depth), c.relname
+        """,
+        (table.qualified,),
+    )
+    return cursor.fetchall()
+
+
+def lock_table(cursor, table: PartitionedTable):
+    """Serialise partition DDL and merges on ``table`` until the transaction ends.
+
+    ``(channel_name, message_id)`` cannot be unique on a table partitioned by
+    date, so concurrent loads (e.g. a per-day backfill) would otherwise race
+    their NOT EXISTS checks into duplicate rows.
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (table.qualified,))
+
+
+def ensure_partitions(cursor, table: PartitionedTable, months):
+    """Create the monthly partitions covering ``months`` (any dates within them)."""
+    for month in sorted({month_start(m) for m in months}):
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table.schema}.{partition_name(table, month)}
+            PARTITION OF {table.qualified}
+            FOR VALUES FROM ({_bound(table, month)}) TO ({_bound(table, add_months(month, 1))});
+            """
+        )
+
+
+def ensure_upcoming(cursor, table: PartitionedTable, months_ahead: int = PREMAKE_MONTHS):
+    today = month_start(datetime.now(timezone.utc).date())
+    ensure_partitions(cursor, table, [add_months(today, i) for i in range(months_ahead + 1)])
+
+
+def ensure_table(cursor, table: PartitionedTable):
+    """Create ``table`` partitioned by month on its key, migrating a plain table in place.
+
+    Rows without a key value land in a default partition. Views on a migrated
+    table (e.g. dbt's staging models) follow the renamed legacy table, so they
+    are dropped with it and recreated on the partitioned one.
+    """
+    lock_table(cursor, table)
+    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {table.schema};")
+    kind = _relkind(cursor, table)
+    if kind == "p":
+        ensure_upcoming(cursor, table)
+        return
+
+    legacy = f"{table.name}_unpartitioned"
+    views = []
+    if kind is not None:
+        # Definitions are read before the rename so they still name ``table``
+        views = dependent_views(cursor, table)
+        cursor.execute(f"ALTER TABLE {table.qualified} RENAME TO {legacy};")
+
+    cursor.execute(f"CREATE TABLE {table.qualified} ({table.columns}) PARTITION BY RANGE ({table.key});")
+    cursor.execute(f"CREATE TABLE {table.schema}.{table.name}_default PARTITION OF {table.qualified} DEFAULT;")
+    ensure_upcoming(cursor, table)
+
+    if kind is not None:
+        cursor.execute(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = %s AND table_name = %s
+            ORDER BY ordinal_position
+            """,
+            (table.schema, legacy),
+        )
+        legacy_columns = {row[0] for row in cursor.fetchall()}
+        cursor.execute(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = %s AND table_name = %s
+            ORDER BY ordinal_position
+            """,
+            (table.schema, table.name),
+        )
+        columns = ", ".join(row[0] for row in cursor.fetchall() if row[0] in legacy_columns)
+        cursor.execute(
+            f"SELECT DISTINCT {month_expr(table)} FROM {table.schema}.{legacy} WHERE {table.key} IS NOT NULL;"
+        )
+        ensure_partitions(cursor, table, [row[0] for row in cursor.fetchall()])
+        cursor.execute(f"INSERT INTO {table.qualified} ({columns}) SELECT {columns} FROM {table.schema}.{legacy};")
+        cursor.execute(f"DROP TABLE {table.schema}.{legacy} CASCADE;")
+        for name, relkind, definition in views:
+            materialized = "MATERIALIZED " if relkind == "m" else ""
+            cursor.execute(f"CREATE {materialized}VIEW {name} AS {definition}")
+
+    for index_name, columns in table.indexes:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table.qualified} ({columns});")
+
+
+def monthly_partitions(cursor, table: PartitionedTable) -> list:
+    """``(partition_name, month)`` for every attached monthly partition of ``table``."""
+    cursor.execute(
+        """
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        JOIN pg_namespace n ON n.oid = p.relnamespace
+        WHERE n.nspname = %s AND p.relname = %s
+        """,
+        (table.schema, table.name),
+    )
+    partitions = []
+    for (relname,) in cursor.fetchall():
+        match = PARTITION_NAME.search(relname)
+        if match:
+            partitions.append((relname, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def retain(cursor, table: PartitionedTable, keep_months: int = RETENTION_MONTHS, drop: bool = False) -> list:
+    """Detach (and optionally drop) monthly partitions older than ``keep_months``.
+
+    Detaching is a catalog change, so removing a month costs the same however
+    many rows it holds. Detached partitions stay around as plain tables until
+    dropped.
+    """
+    cutoff = add_months(month_start(datetime.now(timezone.utc).date()), -keep_months)
+    removed = []
+    for relname, month in monthly_partitions(cursor, table):
+        if month >= cutoff:
+            continue
+        cursor.execute(f"ALTER TABLE {table.qualified} DETACH PARTITION {table.schema}.{relname};")
+        if drop:
+            cursor.execute(f"DROP TABLE {table.schema}.{relname};")
+        removed.append(relname)
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain monthly partitions of the raw tables")
+    sub = parser.add_subparsers(dest="command", required=True)
+    premake = sub.add_parser("premake", help="create upcoming monthly partitions")
+    premake.add_argument("--months-ahead", type=int, default=PREMAKE_MONTHS)
+    keep = sub.add_parser("retain", help="detach partitions older than the retention window")
+    keep.add_argument("--keep-months", type=int, default=RETENTION_MONTHS)
+    keep.add_argument("--drop", action="store_true", help="drop detached partitions instead of keeping them as tables")
+    parser.add_argument("--table", choices=sorted(TABLES), action="append", help="default: all raw tables")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    cur = conn.cursor()
+    for name in args.table or sorted(TABLES):
+        table = TABLES[name]
+        ensure_table(cur, table)
+        if args.command == "premake":
+            ensure_upcoming(cur, table, args.months_ahead)
+            print(f"{name}: partitions ready through {args.months_ahead} months ahead")
+        else:
+            removed = retain(cur, table, args.keep_months, args.drop)
+            action = "Dropped" if args.drop else "Detached"
+            print(f"{name}: {action} {len(removed)} partitions {removed}")
+        conn.commit()
+    cur.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
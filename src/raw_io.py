@@ -0,0 +1,301 @@
+import io
+import os
+import csv
+import gzip
+import json
+import zlib
+from operator import itemgetter
+from pathlib import Path
+from loguru import logger
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+RAW_SUFFIXES = (".json", ".jsonl", ".jsonl.gz", ".parquet")
+
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+PARQUET_ROW_GROUP_SIZE = int(os.getenv("PARQUET_ROW_GROUP_SIZE", "10000"))
+
+MESSAGE_SCHEMA = pa.schema(
+    [
+        ("message_id", pa.int64()),
+        ("channel_name", pa.string()),
+        ("message_date", pa.timestamp("us", tz="UTC")),
+        ("message_text", pa.string()),
+        ("views", pa.int64()),
+        ("forwards", pa.int64()),
+        ("has_media", pa.bool_()),
+        ("image_path", pa.string()),
+    ]
+)
+
+DETECTION_SCHEMA = pa.schema(
+    [
+        ("message_id", pa.int64()),
+        ("channel_name", pa.string()),
+        ("image_path", pa.string()),
+        ("detected_class", pa.string()),
+        ("confidence", pa.float64()),
+        ("image_category", pa.string()),
+    ]
+)
+
+
+def open_text(path: Path, mode: str):
+    if path.name.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _truncate_partial_line(path: Path, chunk_size: int = 1 << 16):
+    """Cut ``path`` back to just after its last newline."""
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - chunk_size)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b"\n")
+            if newline != -1:
+                pos = start + newline + 1
+                break
+            pos = start
+        if pos != end:
+            logger.warning("Dropping {} bytes of a partial record at the end of {}", end - pos, path)
+            f.truncate(pos)
+
+
+def _next_part(path: Path) -> Path:
+    """``path`` if it is free, else the next free ``<name>.p<nnn>.jsonl.gz`` beside it.
+
+    Parts sort after the first file and in run order, which is the order the
+    loader reads them in, so later records win its merge.
+    """
+    if not path.exists():
+        return path
+    base = path.name[: -len(".jsonl.gz")]
+    n = 1
+    while (path.parent / f"{base}.p{n:03d}.jsonl.gz").exists():
+        n += 1
+    return path.parent / f"{base}.p{n:03d}.jsonl.gz"
+
+
+class JsonlWriter:
+    """Append one JSON object per line, flushing every ``flush_every`` records.
+
+    Plain files are opened in append mode, so a rerun (or a resumed crash)
+    extends the existing file; a partial last line left by a crash is cut off
+    first so the next record starts on its own line. A gzip member cut short by
+    a crash cannot be appended to, so each gzip run writes a new
+    ``<name>.p<nnn>.jsonl.gz`` part next to the first file instead.
+    """
+
+    def __init__(self, path: Path, flush_every: int = 50):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.name.endswith(".gz"):
+            path = _next_part(path)
+        elif path.exists():
+            _truncate_partial_line(path)
+        self.path = path
+        self.flush_every = flush_every
+        self.count = 0
+        self._f = open_text(path, "a")
+
+    def write(self, record: dict):
+        self._f.write(json.dumps(record, ensure_ascii=False))
+        self._f.write("\n")
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self._f.flush()
+
+    @property
+    def closed(self) -> bool:
+        return self._f.closed
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CsvWriter:
+    """CSV of dict rows with the same interface as the Parquet writers.
+
+    Rows are projected to ``fieldnames`` tuples and written in one
+    ``writerows`` call per batch, skipping ``DictWriter``'s per-row key checks.
+    """
+
+    def __init__(self, path: Path, fieldnames: list):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._f = path.open("w", newline="")
+        self._writer = csv.writer(self._f)
+        self._writer.writerow(fieldnames)
+        self._project = itemgetter(*fieldnames)
+
+    def writerows(self, rows: list):
+        self._writer.writerows(map(self._project, rows))
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def records_to_table(records: list, schema: pa.Schema) -> pa.Table:
+    # Timestamps arrive as ISO strings (their JSONL form) and are parsed in one cast
+    staged = pa.schema(
+        [pa.field(f.name, pa.string()) if pa.types.is_timestamp(f.type) else f for f in schema]
+    )
+    return pa.Table.from_pylist(records, schema=staged).cast(schema)
+
+
+class ParquetWriter:
+    """Buffer records and write them to ``path`` as compressed Parquet row groups.
+
+    A Parquet file is only readable once closed (its footer holds the row-group
+    index), so callers write a new part file per run instead of appending. No
+    file is created if nothing was written.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        schema: pa.Schema,
+        row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+        compression: str = PARQUET_COMPRESSION,
+    ):
+        self.path = path
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.count = 0
+        self._rows = []
+        self._writer = None
+        self._closed = False
+
+    def write(self, record: dict):
+        self._rows.append(record)
+        self.count += 1
+        if len(self._rows) >= self.row_group_size:
+            self._flush()
+
+    def writerows(self, rows: list):
+        for row in rows:
+            self.write(row)
+
+    def _flush(self):
+        if not self._rows:
+            return
+        if self._writer is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._writer = pq.ParquetWriter(str(self.path), self.schema, compression=self.compression)
+        self._writer.write_table(records_to_table(self._rows, self.schema))
+        self._rows = []
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def close(self):
+        if self._closed:
+            return
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PartitionedParquetWriter:
+    """Route rows to ``<root>/<row[partition_by]>/<filename>``, one Parquet file per value."""
+
+    def __init__(self, root: Path, filename: str, schema: pa.Schema, partition_by: str):
+        self.root = root
+        self.filename = filename
+        self.schema = schema
+        self.partition_by = partition_by
+        self._writers = {}
+
+    def writerows(self, rows: list):
+        for row in rows:
+            key = row[self.partition_by]
+            writer = self._writers.get(key)
+            if writer is None:
+                writer = self._writers[key] = ParquetWriter(self.root / key / self.filename, self.schema)
+            writer.write(row)
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_raw_files(day_dir: Path) -> list:
+    """Raw files of one day: ``<channel>.jsonl(.gz)`` and ``<channel>/part-*.parquet``."""
+    return sorted(p for p in day_dir.rglob("*") if p.is_file() and p.name.endswith(RAW_SUFFIXES))
+
+
+def iter_record_batches(path: Path, columns: list, batch_size: int):
+    """Yield Arrow record batches of ``columns`` from a Parquet file."""
+    yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns)
+
+
+def arrow_csv_buffer(batch) -> io.BytesIO:
+    """Serialise an Arrow batch for ``COPY ... WITH (FORMAT csv)``.
+
+    Every non-null value is quoted, so NULLs stay unquoted empty fields (COPY's
+    default NULL) while empty strings survive as ``""``.
+    """
+    buf = io.BytesIO()
+    pacsv.write_csv(batch, buf, pacsv.WriteOptions(include_header=False, quoting_style="all_valid"))
+    buf.seek(0)
+    return buf
+
+
+def iter_records(path: Path):
+    """Yield message dicts from a legacy ``.json`` array, a (gzipped) JSONL file or Parquet.
+
+    JSONL is read line by line; a truncated trailing record left by an
+    interrupted scrape is logged and skipped.
+    """
+    if path.suffix == ".parquet":
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+        return
+
+    if path.suffix == ".json":
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+        return
+
+    with open_text(path, "r") as f:
+        try:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Skipping malformed record at {}:{}", path, line_no)
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            logger.warning("Truncated or corrupt gzip stream in {} ({}); keeping records read so far", path, e)
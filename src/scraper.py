@@ -1,35 +1,210 @@
 import os
 import json
-from datetime import datetime
+import asyncio
+import argparse
+import multiprocessing
+from datetime import datetime, timezone
 from pathlib import Path
 from dotenv import load_dotenv
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError
 from telethon.tl.types import MessageMediaPhoto
 from loguru import logger
 
+import metrics
+from channel_registry import Channel, is_due, load_channels, shard
+from image_dedup import PhashIndex, dedupe_download
+from raw_io import MESSAGE_SCHEMA, JsonlWriter, ParquetWriter
+from settings import env_flag
+
 # -------------------- Setup --------------------
 load_dotenv()
 
-API_ID = int(os.getenv("TELEGRAM_API_ID"))
+API_ID = os.getenv("TELEGRAM_API_ID")
 API_HASH = os.getenv("TELEGRAM_API_HASH")
 
 BASE_DATA_PATH = Path("data/raw")
 IMAGE_PATH = BASE_DATA_PATH / "images"
 MESSAGE_PATH = BASE_DATA_PATH / "telegram_messages"
+# One state file per channel, so sharded sessions never write the same file
+STATE_DIR = BASE_DATA_PATH / "scraper_state"
+LEGACY_STATE_FILE = BASE_DATA_PATH / "scraper_state.json"
+
+# Raw messages stream to <channel>.jsonl (or .jsonl.gz parts) as they are scraped
+RAW_GZIP = env_flag("SCRAPER_GZIP")
+RAW_FLUSH_EVERY = int(os.getenv("SCRAPER_FLUSH_EVERY", "50"))
+# "parquet" writes <date>/<channel>/part-<time>.parquet per run instead of JSONL
+RAW_FORMAT = os.getenv("SCRAPER_FORMAT", "jsonl")
+
+# Messages fetched for a channel with no high-water mark yet (unless backfilling)
+INITIAL_LIMIT = 500
+# Telegram's maximum messages per history request
+HISTORY_PAGE_SIZE = 100
 
 LOG_PATH = Path("logs")
 LOG_PATH.mkdir(exist_ok=True)
 
 logger.add(LOG_PATH / "scraper.log", rotation="1 MB")
 
-CHANNELS = {
-    "chemed": "https://t.me/CheMed123",
-    "lobelia4cosmetics": "https://t.me/lobelia4cosmetics",
-    "tikvahpharma": "https://t.me/tikvahpharma"
-}
+# Telethon sessions (separately logged-in accounts); channels are sharded
+# across them, one process per session.
+SESSIONS = [s.strip() for s in os.getenv("SCRAPER_SESSIONS", "session").split(",") if s.strip()]
+# Per-session cap on Telegram API calls (history pages and media downloads)
+REQUESTS_PER_SECOND = float(os.getenv("SCRAPER_REQUESTS_PER_SECOND", "2"))
+# Channels scraped at once within a session, taken in priority order
+CHANNEL_CONCURRENCY = int(os.getenv("SCRAPER_CHANNEL_CONCURRENCY", "4"))
+
+# Parallel photo downloads shared by all channels, and FloodWait handling.
+MEDIA_CONCURRENCY = int(os.getenv("SCRAPER_MEDIA_CONCURRENCY", "4"))
+FLOOD_WAIT_RETRIES = int(os.getenv("SCRAPER_FLOOD_WAIT_RETRIES", "3"))
+# Telethon sleeps through FloodWaits up to this many seconds on its own.
+FLOOD_SLEEP_THRESHOLD = int(os.getenv("SCRAPER_FLOOD_SLEEP_THRESHOLD", "60"))
+
+# Near-duplicate photos (reposts across channels) are kept once on disk and
+# referenced by every message that carries them.
+DEDUP_IMAGES = env_flag("SCRAPER_DEDUP_IMAGES", True)
+
+# Streaming mode downloads photos into memory and feeds them to a warm YOLO
+# model while the scrape runs; files are still archived to IMAGE_PATH.
+STREAM_DETECT = env_flag("SCRAPER_STREAM_DETECT")
+
+# -------------------- High-water marks --------------------
+def load_state(channel_name: str) -> dict:
+    """``{"last_id", "last_scraped_at"}`` for a channel, falling back to the old single state file."""
+    path = STATE_DIR / f"{channel_name}.json"
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    if LEGACY_STATE_FILE.exists():
+        with open(LEGACY_STATE_FILE, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+        if channel_name in legacy:
+            return {"last_id": legacy[channel_name], "last_scraped_at": None}
+    return {"last_id": 0, "last_scraped_at": None}
+
+
+def save_state(channel_name: str, state: dict):
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    path = STATE_DIR / f"{channel_name}.json"
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    tmp.replace(path)
+
+
+def due_channels(backfill: bool = False) -> list:
+    """Registry channels whose schedule says they should be scraped now (all of them for a backfill)."""
+    channels = load_channels()
+    if backfill:
+        return channels
+    now = datetime.now(timezone.utc)
+    return [c for c in channels if is_due(c, load_state(c.name)["last_scraped_at"], now)]
+
+# -------------------- Rate limiting --------------------
+class RateLimiter:
+    """Space out one session's API calls to at most ``rate`` per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+# -------------------- History --------------------
+async def iter_history(client, channel_url, limiter: RateLimiter, limit: int | None = None, min_id: int = 0):
+    """Yield a channel's messages newest first, one rate-limited request per page."""
+    await limiter.wait()
+    entity = await client.get_input_entity(channel_url)
+    offset_id, fetched = 0, 0
+    while limit is None or fetched < limit:
+        page_size = HISTORY_PAGE_SIZE if limit is None else min(HISTORY_PAGE_SIZE, limit - fetched)
+        await limiter.wait()
+        metrics.count("api_requests")
+        page = await client.get_messages(entity, limit=page_size, offset_id=offset_id, min_id=min_id)
+        if not page:
+            break
+        for message in page:
+            yield message
+        fetched += len(page)
+        offset_id = page[-1].id
+
+# -------------------- Media downloads --------------------
+async def download_with_backoff(client, message, target, limiter: RateLimiter):
+    # ``target`` is a path, or ``bytes`` to download into memory
+    for attempt in range(FLOOD_WAIT_RETRIES + 1):
+        try:
+            await limiter.wait()
+            metrics.count("api_requests")
+            return await client.download_media(message.photo, target)
+        except FloodWaitError as e:
+            metrics.count("flood_waits")
+            if attempt == FLOOD_WAIT_RETRIES:
+                raise
+            logger.warning(f"FloodWait on media {message.id}: sleeping {e.seconds}s")
+            await asyncio.sleep(e.seconds + 1)
+
+
+async def media_worker(client, queue: asyncio.Queue, limiter: RateLimiter, index: PhashIndex | None = None, detector=None):
+    # Resolves each item's future with the path the message should reference (None on failure)
+    while True:
+        message, channel_name, image_file, done = await queue.get()
+        try:
+            data = None
+            if detector is not None:
+                data = await download_with_backoff(client, message, bytes, limiter)
+                await asyncio.to_thread(image_file.write_bytes, data)
+            else:
+                await download_with_backoff(client, message, image_file, limiter)
+            metrics.count("images_downloaded")
+            metrics.count("bytes", image_file.stat().st_size)
+            image_path = str(image_file)
+            if index is not None:
+                try:
+                    # Decoding, resizing and the index commits would otherwise block the event loop
+                    image_path = await asyncio.to_thread(dedupe_download, index, channel_name, message.id, image_file)
+                except Exception as e:
+                    logger.warning(f"Could not hash {image_file}, keeping it as-is: {e}")
+                if image_path != str(image_file):
+                    metrics.count("images_deduplicated")
+            done.set_result(image_path)
+            # Duplicates reuse the canonical image's detections
+            if data is not None and image_path == str(image_file):
+                await detector.submit(channel_name, image_file, data)
+        except Exception as e:
+            logger.error(f"Failed downloading media {message.id} to {image_file}: {e}")
+            done.set_result(None)
+        finally:
+            queue.task_done()
 
 # -------------------- Scraper --------------------
-async def scrape_channel(client, channel_name, channel_url):
+async def scrape_channel(
+    client,
+    channel_name,
+    channel_url,
+    media_queue: asyncio.Queue,
+    limiter: RateLimiter,
+    last_id: int = 0,
+    backfill: bool = False,
+):
+    """Fetch messages newer than ``last_id`` and return the new high-water mark.
+
+    Without a high-water mark only the latest ``INITIAL_LIMIT`` messages are
+    fetched; ``backfill`` pages through the channel's entire history instead.
+    The mark stays below the oldest photo that failed to download, so the next
+    run fetches it again. The retried record is written after the failed one
+    (later in the same appended file, a later part or a later day), and the
+    loader's merge keeps the last record per message, so the retry's
+    ``image_path`` replaces the earlier NULL.
+    """
     today = datetime.utcnow().strftime("%Y-%m-%d")
     output_dir = MESSAGE_PATH / today
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -37,46 +212,174 @@ async def scrape_channel(client, channel_name, channel_url):
     image_dir = IMAGE_PATH / channel_name
     image_dir.mkdir(parents=True, exist_ok=True)
 
-    messages_data = []
+    if RAW_FORMAT == "parquet":
+        part = datetime.utcnow().strftime("part-%H%M%S%f.parquet")
+        writer = ParquetWriter(output_dir / channel_name / part, MESSAGE_SCHEMA)
+    else:
+        suffix = ".jsonl.gz" if RAW_GZIP else ".jsonl"
+        writer = JsonlWriter(output_dir / f"{channel_name}{suffix}", flush_every=RAW_FLUSH_EVERY)
+    downloads = []
+    failed_ids = []
+
+    def write_when_downloaded(msg):
+        # Photo messages are written once their download settles; failures keep no
+        # image_path and duplicates point at the canonical image
+        def callback(done):
+            if writer.closed:
+                return
+            msg["image_path"] = None if done.cancelled() else done.result()
+            if msg["image_path"] is None:
+                failed_ids.append(msg["message_id"])
+            writer.write(msg)
+            metrics.count("messages")
+        return callback
 
     logger.info(f"Scraping channel: {channel_name}")
 
-    async for message in client.iter_messages(channel_url, limit=500):
-        msg = {
-            "message_id": message.id,
-            "channel_name": channel_name,
-            "message_date": message.date.isoformat() if message.date else None,
-            "message_text": message.text,
-            "views": message.views,
-            "forwards": message.forwards,
-            "has_media": bool(message.media),
-            "image_path": None
-        }
-
-        # Download image if exists
-        if isinstance(message.media, MessageMediaPhoto):
-            image_file = image_dir / f"{message.id}.jpg"
-            await client.download_media(message.photo, image_file)
-            msg["image_path"] = str(image_file)
-
-        messages_data.append(msg)
-
-    # Save raw JSON
-    output_file = output_dir / f"{channel_name}.json"
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(messages_data, f, ensure_ascii=False, indent=2)
-
-    logger.info(f"Saved {len(messages_data)} messages for {channel_name}")
+    if backfill:
+        limit, min_id = None, 0
+    else:
+        limit, min_id = (None if last_id else INITIAL_LIMIT), last_id
+
+    max_id = last_id
+    try:
+        # History pages share the session's limiter with the media downloads
+        async for message in iter_history(client, channel_url, limiter, limit=limit, min_id=min_id):
+            max_id = max(max_id, message.id)
+            msg = {
+                "message_id": message.id,
+                "channel_name": channel_name,
+                "message_date": message.date.isoformat() if message.date else None,
+                "message_text": message.text,
+                "views": message.views,
+                "forwards": message.forwards,
+                "has_media": bool(message.media),
+                "image_path": None
+            }
+
+            # Queue image download if exists; the bounded queue throttles the scrape
+            if isinstance(message.media, MessageMediaPhoto):
+                image_file = image_dir / f"{message.id}.jpg"
+                msg["image_path"] = str(image_file)
+                if not image_file.exists():
+                    done = asyncio.get_running_loop().create_future()
+                    done.add_done_callback(write_when_downloaded(msg))
+                    await media_queue.put((message, channel_name, image_file, done))
+                    downloads.append(done)
+                    continue
+                metrics.count("images_skipped")
+
+            writer.write(msg)
+            metrics.count("messages")
+
+        # Wait for this channel's images so their records land in the file
+        await asyncio.gather(*downloads)
+    finally:
+        writer.close()
+
+    logger.info(f"Saved {writer.count} messages for {channel_name} to {writer.path}")
+    if failed_ids:
+        # Relies on the loader's last-record-wins merge to replace the NULL image_path
+        logger.warning(f"{len(failed_ids)} photos failed for {channel_name}; retrying from message {min(failed_ids)} next run")
+        return min(max_id, min(failed_ids) - 1)
+    return max_id
+
+
+async def scrape_channel_safe(client, channel: Channel, media_queue, backfill, semaphore: asyncio.Semaphore, limiter: RateLimiter):
+    # Progress is saved per channel as each one finishes, so a killed run resumes with the rest
+    async with semaphore:
+        try:
+            state = load_state(channel.name)
+            last_id = state["last_id"]
+            # The schedule counts from when a scrape started, not how long it took
+            started_at = datetime.now(timezone.utc).isoformat()
+            max_id = await scrape_channel(
+                client, channel.name, channel.url, media_queue, limiter, last_id=last_id, backfill=backfill
+            )
+            save_state(channel.name, {"last_id": max(max_id, last_id), "last_scraped_at": started_at})
+        except Exception as e:
+            logger.error(f"Failed scraping {channel.name}: {e}")
 
 # -------------------- Main --------------------
-async def main():
-    async with TelegramClient("session", API_ID, API_HASH) as client:
-        for name, url in CHANNELS.items():
+async def main(backfill: bool = False, detect: bool = STREAM_DETECT, channels: list | None = None, session: str = SESSIONS[0]):
+    """Scrape ``channels`` (default: every due channel) through one Telethon session."""
+    if channels is None:
+        channels = due_channels(backfill)
+    with metrics.span("scrape"):
+        metrics.count("channels", len(channels))
+        logger.info(f"Session {session}: scraping {len(channels)} channels")
+        async with TelegramClient(session, int(API_ID), API_HASH, flood_sleep_threshold=FLOOD_SLEEP_THRESHOLD) as client:
+            media_queue = asyncio.Queue(maxsize=MEDIA_CONCURRENCY * 4)
+            limiter = RateLimiter(REQUESTS_PER_SECOND)
+            semaphore = asyncio.Semaphore(CHANNEL_CONCURRENCY)
+            index = PhashIndex() if DEDUP_IMAGES else None
+            detector = None
+            if detect:
+                from stream_detect import StreamDetector  # imports torch; only in streaming mode
+
+                detector = StreamDetector()
+                detector.start()
+            workers = [
+                asyncio.create_task(media_worker(client, media_queue, limiter, index, detector))
+                for _ in range(MEDIA_CONCURRENCY)
+            ]
             try:
-                await scrape_channel(client, name, url)
-            except Exception as e:
-                logger.error(f"Failed scraping {name}: {e}")
+                # Channels arrive in priority order and the semaphore admits them in that order
+                await asyncio.gather(
+                    *(scrape_channel_safe(client, channel, media_queue, backfill, semaphore, limiter) for channel in channels)
+                )
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                if detector is not None:
+                    await detector.close()
+                if index is not None:
+                    index.close()
+
+
+def _run_shard(session: str, channels: list, backfill: bool, detect: bool, run_id: str | None):
+    metrics.set_run_id(run_id)
+    asyncio.run(main(backfill=backfill, detect=detect, channels=channels, session=session))
+
+
+def run(backfill: bool = False, detect: bool = STREAM_DETECT):
+    """Synchronous entry point for callers outside an event loop (e.g. the pipeline).
+
+    Due channels are sharded across ``SESSIONS``; with more than one session
+    each shard runs in its own process. In streaming mode the day's detections
+    file is written from the cache right after the scrape, without running the
+    model again.
+    """
+    channels = due_channels(backfill)
+    if len(SESSIONS) == 1:
+        asyncio.run(main(backfill=backfill, detect=detect, channels=channels, session=SESSIONS[0]))
+    else:
+        ctx = multiprocessing.get_context("spawn")
+        procs = [
+            ctx.Process(
+                target=_run_shard,
+                args=(session, chunk, backfill, detect, metrics.RUN_ID),
+                name=f"scraper-{session}",
+            )
+            for session, chunk in zip(SESSIONS, shard(channels, len(SESSIONS)))
+            if chunk
+        ]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        failed = [proc.name for proc in procs if proc.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"Scraper shards failed: {', '.join(failed)}")
+    if detect:
+        import yolo_detect
+
+        yolo_detect.main(date=datetime.utcnow().strftime("%Y-%m-%d"))
 
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Scrape Telegram channels")
+    parser.add_argument("--backfill", action="store_true", help="page through each channel's full history")
+    parser.add_argument("--detect", action="store_true", default=STREAM_DETECT, help="run YOLO on photos while they download")
+    args = parser.parse_args()
+    run(backfill=args.backfill, detect=args.detect)
@@ -0,0 +1,84 @@
+import os
+import asyncio
+from pathlib import Path
+
+from loguru import logger
+
+import metrics
+import yolo_detect
+from detection_cache import DetectionCache, content_digest
+
+# Downloaded images waiting for the model; a full queue holds back the downloaders
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_DETECT_QUEUE_SIZE", "64"))
+
+
+class StreamDetector:
+    """Run YOLO on photos while the scraper is still downloading them.
+
+    Images arrive as bytes straight from the download, are batched off a bounded
+    queue and detected by one warm model on a worker thread. Results go into the
+    detection cache, so the day's ``yolo_detect --date`` run only re-emits them.
+    """
+
+    def __init__(self, maxsize: int = STREAM_QUEUE_SIZE, batch_size: int = yolo_detect.BATCH_SIZE):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.cache = DetectionCache(yolo_detect.CACHE_PATH, yolo_detect.runtime_model_path(), yolo_detect.CONF_THRESHOLD)
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, channel_name: str, img_path: Path, data: bytes):
+        if self._task is None or self._task.done():
+            return  # worker failed to start (e.g. no model); the batch run covers these images
+        await self.queue.put((channel_name, img_path, data))
+
+    async def _run(self):
+        model = await asyncio.to_thread(yolo_detect.get_model)
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                await self._detect(model, batch)
+            except Exception as e:
+                # Anything missed here is picked up by the regular detection run
+                logger.exception("Streaming detection failed for {} images: {}", len(batch), e)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _detect(self, model, batch):
+        pending = []
+        digests = {}
+        for channel_name, img_path, data in batch:
+            digest = content_digest(data)
+            if self.cache.get(digest) is not None:
+                metrics.count("stream_cached")
+                continue
+            pending.append((channel_name, img_path, data))
+            digests[str(img_path)] = digest
+        if not pending:
+            return
+
+        rows = await asyncio.to_thread(yolo_detect.detect_encoded, model, pending)
+        by_image = {}
+        for row in rows:
+            by_image.setdefault(row["image_path"], []).append(row)
+        for image_path, image_rows in by_image.items():
+            self.cache.put(digests[image_path], image_rows)
+        self.cache.commit()
+        metrics.count("stream_detected", len(by_image))
+
+    async def close(self):
+        """Drain the queue, then stop the worker."""
+        if self._task is not None:
+            if not self._task.done():
+                await self.queue.join()
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self.cache.close()
@@ -1,18 +1,62 @@
 import os
-import csv
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
+
+import cv2
+import numpy as np
 from loguru import logger
 from ultralytics import YOLO
 
+import metrics
+from detection_cache import DetectionCache, rows_from_cache
+from image_dedup import INDEX_PATH, PhashIndex
+from raw_io import DETECTION_SCHEMA, CsvWriter, PartitionedParquetWriter, iter_raw_files, iter_records
+from settings import env_flag
+
 IMAGE_ROOT = Path("data/raw/images")
+MESSAGE_ROOT = Path("data/raw/telegram_messages")
 OUTPUT_ROOT = Path("data/raw/yolo_detections")
 OUTPUT_ROOT.mkdir(parents=True, exist_ok=True)
 
+logger.add(Path("logs") / "yolo_detect.log", rotation="1 MB")
+
 MODEL_PATH = "yolov8n.pt"
+# "torch" runs MODEL_PATH as-is; "onnx" (ONNX Runtime) and "openvino" export it
+# once next to the weights and load the export. YOLO_INT8 quantises the export.
+RUNTIME = os.getenv("YOLO_RUNTIME", "torch")
+INT8 = env_flag("YOLO_INT8")
+RUNTIMES = ("torch", "onnx", "openvino")
+CONF_THRESHOLD = 0.25
 PRODUCT_CLASSES = {"bottle", "cup", "vase"}
 PERSON_CLASS = "person"
 
+# Inference tuning; WORKERS > 1 shards images across processes, one model each
+# (torch runtime only, see run_detection).
+BATCH_SIZE = int(os.getenv("YOLO_BATCH_SIZE", "16"))
+DECODE_THREADS = int(os.getenv("YOLO_DECODE_THREADS", "4"))
+WORKERS = int(os.getenv("YOLO_WORKERS", "1"))
+
+CACHE_PATH = Path(os.getenv("YOLO_CACHE_PATH", "data/cache/yolo_detections.sqlite"))
+
+# "parquet" writes <date>/<channel>/detections.parquet instead of <date>/detections.csv
+OUTPUT_FORMAT = os.getenv("YOLO_OUTPUT_FORMAT", "csv")
+
+FIELDNAMES = [
+    "message_id",
+    "channel_name",
+    "image_path",
+    "detected_class",
+    "confidence",
+    "image_category",
+]
+
+_worker_model = None
+
 
 def classify_image(detected_classes: set) -> str:
     has_person = PERSON_CLASS in detected_classes
@@ -34,84 +78,350 @@ def iter_image_files(root: Path):
                     yield channel_dir.name, img
 
 
-def main():
-    logger.add(Path("logs") / "yolo_detect.log", rotation="1 MB")
-    logger.info("Loading YOLO model: {}", MODEL_PATH)
-    model = YOLO(MODEL_PATH)
-
-    date_str = datetime.utcnow().strftime("%Y-%m-%d")
-    output_dir = OUTPUT_ROOT / date_str
-    output_dir.mkdir(parents=True, exist_ok=True)
-    output_csv = output_dir / "detections.csv"
-
-    total_images = 0
-    total_rows = 0
-
-    with output_csv.open("w", newline="") as f:
-        writer = csv.DictWriter(
-            f,
-            fieldnames=[
-                "message_id",
-                "channel_name",
-                "image_path",
-                "detected_class",
-                "confidence",
-                "image_category",
-            ],
-        )
-        writer.writeheader()
+def dated_image_refs(message_root: Path, date: str) -> dict:
+    """``image_path -> [(channel_name, message_id), ...]`` for the messages scraped on ``date``.
+
+    Deduplicated photos appear once, referenced by every message that carries them.
+    """
+    refs = {}
+    day_dir = message_root / date
+    if not day_dir.is_dir():
+        return refs
+    for raw_file in iter_raw_files(day_dir):
+        for msg in iter_records(raw_file):
+            image_path = msg.get("image_path")
+            if image_path and Path(image_path).exists():
+                refs.setdefault(image_path, []).append((msg["channel_name"], msg["message_id"]))
+    return refs
+
+
+def parse_message_id(img_path: Path):
+    # message_id might include extra tokens; best-effort int conversion
+    try:
+        return int(img_path.stem)
+    except ValueError:
+        return None
+
+
+def all_image_refs(image_root: Path) -> dict:
+    """Every image under ``image_root`` plus the duplicate messages that point at it."""
+    refs = {
+        str(img_path): [(channel_name, parse_message_id(img_path))]
+        for channel_name, img_path in iter_image_files(image_root)
+    }
+    if INDEX_PATH.exists():
+        index = PhashIndex(INDEX_PATH)
+        try:
+            for image_path, duplicates in index.aliases().items():
+                if image_path in refs:
+                    refs[image_path].extend(duplicates)
+        finally:
+            index.close()
+    return refs
+
+
+def fan_out(rows: list, refs: dict) -> list:
+    """Copy each image's rows to every message that references the image."""
+    out = []
+    for row in rows:
+        targets = refs.get(row["image_path"])
+        if not targets:
+            out.append(row)
+            continue
+        for channel_name, message_id in targets:
+            out.append({**row, "channel_name": channel_name, "message_id": message_id})
+    return out
 
-        for channel_name, img_path in iter_image_files(IMAGE_ROOT):
-            total_images += 1
-            try:
-                message_id_str = img_path.stem
-                # message_id might include extra tokens; best-effort int conversion
-                try:
-                    message_id = int(message_id_str)
-                except ValueError:
-                    message_id = None
-
-                results = model.predict(source=str(img_path), conf=0.25, verbose=False)
-                detected_set = set()
-
-                for r in results:
-                    names = r.names
-                    for b in r.boxes:
-                        cls_idx = int(b.cls.item()) if hasattr(b.cls, "item") else int(b.cls)
-                        conf = float(b.conf.item()) if hasattr(b.conf, "item") else float(b.conf)
-                        cls_name = names.get(cls_idx, str(cls_idx))
-                        detected_set.add(cls_name)
-                        writer.writerow(
-                            {
-                                "message_id": message_id,
-                                "channel_name": channel_name,
-                                "image_path": str(img_path),
-                                "detected_class": cls_name,
-                                "confidence": round(conf, 4),
-                                "image_category": classify_image(detected_set),
-                            }
-                        )
-                        total_rows += 1
-
-                # If no detections, still write a summary row
-                if not detected_set:
-                    writer.writerow(
-                        {
-                            "message_id": message_id,
-                            "channel_name": channel_name,
-                            "image_path": str(img_path),
-                            "detected_class": "",
-                            "confidence": 0.0,
-                            "image_category": classify_image(detected_set),
-                        }
-                    )
-                    total_rows += 1
 
+def read_image(img_path: Path):
+    """Decode an image to the BGR array ``model.predict`` expects (None on failure)."""
+    return cv2.imread(str(img_path))
+
+
+def decode_image(data: bytes):
+    """Decode in-memory image bytes to a BGR array (None on failure)."""
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def iter_batches(items, batch_size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_decoded_batches(items, batch_size: int, pool: ThreadPoolExecutor, prefetch: int = 2):
+    """Yield ``(batch, images)`` while the next ``prefetch`` batches decode on ``pool``."""
+    pending = deque()
+    for batch in iter_batches(items, batch_size):
+        pending.append((batch, [pool.submit(read_image, img_path) for _, img_path in batch]))
+        if len(pending) > prefetch:
+            batch, futures = pending.popleft()
+            yield batch, [f.result() for f in futures]
+    while pending:
+        batch, futures = pending.popleft()
+        yield batch, [f.result() for f in futures]
+
+
+def as_numpy(values) -> np.ndarray:
+    """``boxes.cls``/``boxes.conf`` as a NumPy array, whether a torch tensor or already NumPy."""
+    if hasattr(values, "cpu"):
+        values = values.cpu().numpy()
+    return np.asarray(values)
+
+
+def rows_for_result(channel_name: str, img_path: Path, result) -> list:
+    """Rows for one image's detections, all carrying the same image-level category."""
+    cls_ids = as_numpy(result.boxes.cls).astype(np.int64)
+    confs = np.round(as_numpy(result.boxes.conf).astype(np.float64), 4)
+    names = result.names
+    lookup = {i: names.get(i, str(i)) for i in np.unique(cls_ids).tolist()}
+    classes = [lookup[i] for i in cls_ids.tolist()]
+
+    base = {
+        "message_id": parse_message_id(img_path),
+        "channel_name": channel_name,
+        "image_path": str(img_path),
+        "image_category": classify_image(set(lookup.values())),
+    }
+    # If no detections, still write a summary row
+    if not classes:
+        return [{**base, "detected_class": "", "confidence": 0.0}]
+    return [{**base, "detected_class": cls_name, "confidence": conf} for cls_name, conf in zip(classes, confs.tolist())]
+
+
+def detect_batch(model, batch, images) -> list:
+    """Run one ``model.predict`` call over a decoded batch and return CSV rows."""
+    valid = []
+    for (channel_name, img_path), image in zip(batch, images):
+        if image is None:
+            logger.error("Could not decode {}", img_path)
+            continue
+        valid.append((channel_name, img_path, image))
+    if not valid:
+        return []
+
+    try:
+        results = model.predict(source=[image for _, _, image in valid], conf=CONF_THRESHOLD, verbose=False)
+    except Exception as e:
+        # Fall back to one image at a time so a single bad input doesn't drop the batch
+        logger.warning("Batch inference failed ({}); retrying images individually", e)
+        rows = []
+        for channel_name, img_path, image in valid:
+            try:
+                result = model.predict(source=image, conf=CONF_THRESHOLD, verbose=False)[0]
+                rows.extend(rows_for_result(channel_name, img_path, result))
             except Exception as e:
                 logger.exception("Detection failed for {}: {}", img_path, e)
+        return rows
+
+    rows = []
+    for (channel_name, img_path, _), result in zip(valid, results):
+        rows.extend(rows_for_result(channel_name, img_path, result))
+    return rows
 
-    logger.info("Processed {} images; wrote {} rows to {}", total_images, total_rows, output_csv)
+
+def detect_encoded(model, items) -> list:
+    """Rows for ``(channel_name, img_path, data)`` items whose images are still in memory."""
+    batch = [(channel_name, img_path) for channel_name, img_path, _ in items]
+    return detect_batch(model, batch, [decode_image(data) for _, _, data in items])
+
+
+def detect_images(model, items, batch_size: int = BATCH_SIZE, decode_threads: int = DECODE_THREADS):
+    """Yield ``(images_in_batch, rows)`` for ``(channel_name, img_path)`` items."""
+    with ThreadPoolExecutor(max_workers=decode_threads) as pool:
+        for batch, images in iter_decoded_batches(items, batch_size, pool):
+            yield len(batch), detect_batch(model, batch, images)
+
+
+def _init_worker(threads_per_worker: int, model_path: str):
+    global _worker_model
+    import torch
+
+    torch.set_num_threads(threads_per_worker)
+    _worker_model = YOLO(model_path, task="detect")
+
+
+def _detect_chunk(chunk) -> tuple:
+    count, rows = 0, []
+    for n, batch_rows in detect_images(_worker_model, chunk):
+        count += n
+        rows.extend(batch_rows)
+    return count, rows
+
+
+def _move(exported: str, target: Path) -> str:
+    # Exporters name their output after the weights; keep one stable name per variant
+    if Path(exported).resolve() != target.resolve():
+        Path(exported).replace(target)
+    return str(target)
+
+
+def runtime_model_path(weights: str | None = None, runtime: str | None = None, int8: bool | None = None) -> str:
+    """Path of the model to load for ``runtime``, exporting ``weights`` on first use."""
+    weights = Path(weights or MODEL_PATH)
+    runtime = runtime or RUNTIME
+    int8 = INT8 if int8 is None else int8
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Unknown YOLO runtime {runtime!r}; expected one of {RUNTIMES}")
+    if runtime == "torch":
+        return str(weights)
+
+    if runtime == "onnx":
+        onnx_path = weights.with_suffix(".onnx")
+        if not onnx_path.exists():
+            logger.info("Exporting {} to ONNX", weights)
+            _move(YOLO(str(weights)).export(format="onnx", dynamic=True), onnx_path)
+        if not int8:
+            return str(onnx_path)
+        int8_path = weights.with_name(f"{weights.stem}.int8.onnx")
+        if not int8_path.exists():
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            logger.info("Quantising {} to INT8", onnx_path)
+            quantize_dynamic(str(onnx_path), str(int8_path), weight_type=QuantType.QUInt8)
+        return str(int8_path)
+
+    openvino_dir = weights.with_name(f"{weights.stem}{'_int8' if int8 else ''}_openvino_model")
+    if not openvino_dir.exists():
+        logger.info("Exporting {} to OpenVINO{}", weights, " (INT8)" if int8 else "")
+        _move(YOLO(str(weights)).export(format="openvino", int8=int8, dynamic=True), openvino_dir)
+    return str(openvino_dir)
+
+
+def get_model(model_path: str | None = None):
+    """The configured runtime's model, loaded once per process and reused warm."""
+    return _load_model(model_path or runtime_model_path())
+
+
+@lru_cache(maxsize=None)
+def _load_model(model_path: str):
+    logger.info("Loading YOLO model: {}", model_path)
+    return YOLO(model_path, task="detect")
+
+
+def run_detection(items, workers: int = WORKERS, runtime: str | None = None):
+    """Yield ``(images, rows)`` either in-process or sharded over ``workers`` processes.
+
+    Only the torch runtime is sharded: worker threads are capped through
+    ``torch.set_num_threads``, while ONNX Runtime and OpenVINO sessions are
+    created inside ultralytics with one thread per core and would oversubscribe
+    the CPU with several processes. Those runtimes already use every core from
+    a single in-process model.
+    """
+    runtime = runtime or RUNTIME
+    if workers > 1 and runtime != "torch":
+        logger.info("YOLO_WORKERS={} ignored for the {} runtime; running one in-process model", workers, runtime)
+        workers = 1
+    if workers <= 1:
+        yield from detect_images(get_model(), items)
+        return
+
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    model_path = runtime_model_path()  # export once here, not in every worker
+    chunks = iter_batches(items, BATCH_SIZE * 4)
+    logger.info("Sharding detection across {} workers ({} threads each)", workers, threads_per_worker)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(threads_per_worker, model_path)
+    ) as pool:
+        yield from pool.map(_detect_chunk, chunks)
+
+
+def open_output(output_dir: Path):
+    """Writer for a day's detections; the other format's output for the day is removed."""
+    csv_path = output_dir / "detections.csv"
+    stale = list(output_dir.glob("*/detections.parquet"))
+    if OUTPUT_FORMAT == "parquet":
+        stale.append(csv_path)
+    for path in stale:
+        path.unlink(missing_ok=True)
+    if OUTPUT_FORMAT == "parquet":
+        return PartitionedParquetWriter(output_dir, "detections.parquet", DETECTION_SCHEMA, partition_by="channel_name")
+    return CsvWriter(csv_path, FIELDNAMES)
+
+
+def main(date: str | None = None):
+    """Detect objects and write ``<date>/detections.csv`` (or per-channel Parquet).
+
+    With ``date`` only images referenced by that day's scraped messages are
+    processed; otherwise every image under ``IMAGE_ROOT`` is. Each image is
+    detected once and its rows are written for every message referencing it.
+    """
+    with metrics.span("yolo_detect"):
+        date_str = date or datetime.utcnow().strftime("%Y-%m-%d")
+        refs = dated_image_refs(MESSAGE_ROOT, date) if date else all_image_refs(IMAGE_ROOT)
+        images = [(targets[0][0], Path(image_path)) for image_path, targets in refs.items()]
+        output_dir = OUTPUT_ROOT / date_str
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        # Keyed by the runtime's model file, so PyTorch and exported results never mix
+        cache = DetectionCache(CACHE_PATH, runtime_model_path(), CONF_THRESHOLD)
+        total_images = 0
+        cached_images = 0
+        total_rows = 0
+        started = time.perf_counter()
+
+        with open_output(output_dir) as writer:
+            # Re-emit cached results and queue only unseen images for the model
+            pending = []
+            pending_hashes = {}
+            for channel_name, img_path in images:
+                digest = cache.content_hash(img_path)
+                entries = cache.get(digest)
+                if entries is None:
+                    pending.append((channel_name, img_path))
+                    pending_hashes[str(img_path)] = digest
+                    continue
+                rows = rows_from_cache(parse_message_id(img_path), channel_name, img_path, entries)
+                # Entries cached before categories were per-image may disagree row to row
+                category = classify_image({row["detected_class"] for row in rows if row["detected_class"]})
+                for row in rows:
+                    row["image_category"] = category
+                rows = fan_out(rows, refs)
+                writer.writerows(rows)
+                cached_images += 1
+                total_rows += len(rows)
+            cache.commit()
+            logger.info("{} images served from cache; {} to detect", cached_images, len(pending))
+
+            detect_started = time.perf_counter()
+            for n_images, rows in run_detection(pending) if pending else ():
+                by_image = {}
+                for row in rows:
+                    by_image.setdefault(row["image_path"], []).append(row)
+                for image_path, image_rows in by_image.items():
+                    cache.put(pending_hashes[image_path], image_rows)
+                cache.commit()
+                rows = fan_out(rows, refs)
+                writer.writerows(rows)
+                total_images += n_images
+                total_rows += len(rows)
+
+        cache.close()
+        detect_elapsed = time.perf_counter() - detect_started
+        elapsed = time.perf_counter() - started
+        rate = total_images / detect_elapsed if detect_elapsed > 0 else 0.0
+        logger.info(
+            "Processed {} new images in {:.1f}s ({:.2f} images/sec) plus {} cached; wrote {} rows to {} in {:.1f}s",
+            total_images,
+            detect_elapsed,
+            rate,
+            cached_images,
+            total_rows,
+            output_dir,
+            elapsed,
+        )
+        metrics.count("images", total_images)
+        metrics.count("cached_images", cached_images)
+        metrics.count("rows", total_rows)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Run YOLO detection over scraped images")
+    parser.add_argument("--date", help="only images from messages scraped on this day (YYYY-MM-DD)")
+    args = parser.parse_args()
+    main(date=args.date)
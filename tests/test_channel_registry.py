@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta, timezone
+
+from channel_registry import Channel, is_due, shard
+
+NOW = datetime(2026, 10, 17, 2, 0, tzinfo=timezone.utc)
+
+
+def test_never_scraped_channel_is_due():
+    assert is_due(Channel("a", "u"), None, NOW)
+
+
+def test_daily_channel_due_at_next_cron_even_if_started_later():
+    started = (NOW - timedelta(hours=24) + timedelta(minutes=10)).isoformat()
+    assert is_due(Channel("a", "u", schedule_hours=24), started, NOW)
+
+
+def test_channel_not_due_within_schedule():
+    started = (NOW - timedelta(hours=6)).isoformat()
+    assert not is_due(Channel("a", "u", schedule_hours=24), started, NOW)
+
+
+def test_tolerance_is_applied():
+    started = (NOW - timedelta(hours=23)).isoformat()
+    channel = Channel("a", "u", schedule_hours=24)
+    assert not is_due(channel, started, NOW, tolerance=timedelta(minutes=30))
+    assert is_due(channel, started, NOW, tolerance=timedelta(hours=1))
+
+
+def test_shard_deals_out_channels_by_priority():
+    channels = [Channel(f"c{i}", "u", priority=p) for i, p in enumerate([1, 5, 3, 5, 0])]
+    shards = shard(channels, 2)
+    assert [[c.name for c in s] for s in shards] == [["c1", "c2", "c4"], ["c3", "c0"]]
+
+
+def test_shard_covers_every_channel_once():
+    channels = [Channel(f"c{i}", "u") for i in range(7)]
+    shards = shard(channels, 3)
+    assert sorted(c.name for s in shards for c in s) == sorted(c.name for c in channels)
+    assert [len(s) for s in shards] == [3, 2, 2]
+
+
+def test_shard_with_no_sessions_returns_one_shard():
+    channels = [Channel("a", "u")]
+    assert shard(channels, 0) == [channels]